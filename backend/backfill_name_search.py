@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Script para completar cliente_norm / nombre_norm (búsqueda por nombre sin acentos
+ni mayúsculas) en transacciones y deudores guardados antes de que existieran.
+Ejecutar: python backfill_name_search.py
+"""
+import asyncio
+
+from services.search import NORMALIZED_FIELDS, backfill_normalized_fields
+
+
+async def main():
+    for collection_name, (source, target) in NORMALIZED_FIELDS.items():
+        print(f"🔤 {collection_name}: calculando {target} desde {source}...")
+        total = await backfill_normalized_fields(collection_name)
+        print(f"   ✅ {total} documentos actualizados")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
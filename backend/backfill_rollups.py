@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Script para reconstruir daily_rollups desde el historial de transacciones y caja.
+Ejecutar: python backfill_rollups.py [--desde AAAA-MM-DD]
+"""
+import argparse
+import asyncio
+from datetime import datetime
+
+from services.rollups import rebuild_rollups
+
+
+async def main(desde):
+    rango = f"desde {desde:%Y-%m-%d}" if desde else "de todo el historial"
+    print(f"📊 Reconstruyendo rollups diarios {rango}...")
+    total = await rebuild_rollups(desde)
+    print(f"   ✅ {total} rollups (día, caja) escritos")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruir daily_rollups")
+    parser.add_argument("--desde", type=datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.desde))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Script de benchmark de carga para la API.
+Ejecutar contra un servidor en marcha:
+    python benchmark.py concurrency --url http://localhost:8000 --requests 500 --concurrency 50
+    python benchmark.py sales --url http://localhost:8000 --caja-id 1 --sales 300
+    python benchmark.py s3 --image-url https://<bucket>.s3.amazonaws.com/products/<archivo> --fetches 100
+Sin servidor (arranca la app en procesos nuevos con el MONGODB_URI del .env):
+    python benchmark.py cold-start --runs 5 --index-mode auto
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+
+async def _run_concurrency(url: str, path: str, total: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        async def one_request() -> None:
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"📊 {total} peticiones a {path} con concurrencia {concurrency}")
+    print(f"   Tiempo total: {elapsed:.2f}s")
+    print(f"   Throughput: {total / elapsed:.1f} req/s")
+    print(f"   Latencia media: {statistics.mean(latencies) * 1000:.1f} ms")
+    print(f"   Latencia p95: {p95 * 1000:.1f} ms")
+    print(f"   Errores: {errors}")
+
+
+async def _run_sales(url: str, caja_id: int, total_sales: int, concurrency: int) -> bool:
+    """Dispara ventas en paralelo contra una caja y verifica que el saldo final cuadre."""
+    semaphore = asyncio.Semaphore(concurrency)
+    monto = 1.0
+    sale = {
+        "cliente": "Benchmark",
+        "grupo": "General",
+        "productos": [{"nombre": "Benchmark", "cantidad": 1, "precio_unitario": monto, "subtotal": monto}],
+        "total": monto,
+        "pago": monto,
+        "cambio": 0,
+        "pagado": "SI",
+        "caja_id": caja_id,
+    }
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        before = (await client.get("/api/cash/balance", params={"caja_id": caja_id})).json()["saldo"]
+
+        async def one_sale() -> int:
+            async with semaphore:
+                response = await client.post("/api/transactions/", json=sale)
+                return response.status_code
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(one_sale() for _ in range(total_sales)))
+        elapsed = time.perf_counter() - started
+
+        after = (await client.get("/api/cash/balance", params={"caja_id": caja_id})).json()["saldo"]
+
+    created = sum(1 for status in statuses if status == 201)
+    expected = before + created * monto
+    print(f"🛒 {total_sales} ventas concurrentes en caja {caja_id} ({elapsed:.2f}s)")
+    print(f"   Ventas creadas: {created}")
+    print(f"   Saldo inicial: {before:.2f} | esperado: {expected:.2f} | final: {after:.2f}")
+
+    ok = abs(after - expected) < 0.005
+    print("   ✅ Saldo consistente" if ok else "   ❌ Saldo inconsistente")
+    return ok
+
+
+def _fetch_latencies(fetch, total: int) -> list[float]:
+    latencies = []
+    for _ in range(total):
+        started = time.perf_counter()
+        fetch()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def _print_latencies(label: str, latencies: list[float]) -> None:
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"   {label}: total {sum(latencies):.2f}s | media {statistics.mean(latencies) * 1000:.1f} ms | p95 {p95 * 1000:.1f} ms")
+
+
+def _run_s3(image_url: str, total: int) -> None:
+    """Descargas secuenciales de una imagen: cliente nuevo por llamada vs cliente compartido."""
+    from services.storage import _build_s3_client, _get_s3_bucket_and_key, load_s3_product_image
+
+    bucket, object_key = _get_s3_bucket_and_key(image_url)
+
+    def fetch_with_new_client() -> None:
+        _build_s3_client().get_object(Bucket=bucket, Key=object_key)["Body"].read()
+
+    def fetch_with_pooled_client() -> None:
+        load_s3_product_image(image_url)
+
+    print(f"🪣 {total} descargas secuenciales de {object_key}")
+    _print_latencies("Cliente nuevo por llamada", _fetch_latencies(fetch_with_new_client, total))
+    _print_latencies("Cliente compartido", _fetch_latencies(fetch_with_pooled_client, total))
+
+
+# Corre en un proceso nuevo: importa la app, ejecuta el lifespan y espera /health 200
+_COLD_START_PROBE = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    first_response = None
+    while True:
+        response = client.get("/health")
+        first_response = first_response or time.perf_counter()
+        if response.status_code == 200 or time.perf_counter() - started > {timeout}:
+            break
+        time.sleep(0.02)
+    ready = time.perf_counter()
+print(json.dumps({{
+    "import": imported - started,
+    "first_response": first_response - started,
+    "ready": ready - started,
+    "health": response.json(),
+}}))
+"""
+
+
+def _run_cold_start(runs: int, index_mode: str, timeout: float) -> None:
+    """Tiempo de arranque en frio: import, primera respuesta y readiness de /health."""
+    env = {**os.environ, "MONGODB_INDEX_MODE": index_mode}
+    probe = _COLD_START_PROBE.format(timeout=timeout)
+    results = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", probe],
+            cwd=Path(__file__).resolve().parent,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["process"] = time.perf_counter() - started
+        results.append(result)
+
+    print(f"🧊 {runs} arranques en frío con MONGODB_INDEX_MODE={index_mode}")
+    for label, key in (
+        ("Proceso completo", "process"),
+        ("Import de main", "import"),
+        ("Primera respuesta", "first_response"),
+        ("Listo (/health 200)", "ready"),
+    ):
+        values = [result[key] for result in results]
+        print(f"   {label}: media {statistics.mean(values) * 1000:.0f} ms | máx {max(values) * 1000:.0f} ms")
+    print(f"   Último /health: {results[-1]['health']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de La Tiendita API")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    concurrency = subparsers.add_parser("concurrency", help="Throughput con peticiones concurrentes")
+    concurrency.add_argument("--url", default="http://localhost:8000")
+    concurrency.add_argument("--path", default="/api/transactions/?limit=50")
+    concurrency.add_argument("--requests", type=int, default=500)
+    concurrency.add_argument("--concurrency", type=int, default=50)
+
+    sales = subparsers.add_parser("sales", help="Ventas concurrentes sobre una caja y verificacion del saldo")
+    sales.add_argument("--url", default="http://localhost:8000")
+    sales.add_argument("--caja-id", type=int, required=True)
+    sales.add_argument("--sales", type=int, default=300)
+    sales.add_argument("--concurrency", type=int, default=100)
+
+    s3 = subparsers.add_parser("s3", help="Latencia de descargas de S3 con y sin cliente compartido")
+    s3.add_argument("--image-url", required=True)
+    s3.add_argument("--fetches", type=int, default=100)
+
+    cold_start = subparsers.add_parser("cold-start", help="Tiempo de arranque de la app hasta estar lista")
+    cold_start.add_argument("--runs", type=int, default=5)
+    cold_start.add_argument("--index-mode", choices=("auto", "always", "skip"), default="auto")
+    cold_start.add_argument("--timeout", type=float, default=120)
+
+    args = parser.parse_args()
+
+    if args.command == "concurrency":
+        asyncio.run(_run_concurrency(args.url, args.path, args.requests, args.concurrency))
+    elif args.command == "sales":
+        ok = asyncio.run(_run_sales(args.url, args.caja_id, args.sales, args.concurrency))
+        raise SystemExit(0 if ok else 1)
+    elif args.command == "s3":
+        _run_s3(args.image_url, args.fetches)
+    elif args.command == "cold-start":
+        _run_cold_start(args.runs, args.index_mode, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Script para crear los indices y verificar con explain() que ninguna consulta
+de los routers haga COLLSCAN u ordene en memoria.
+Ejecutar: python check_indexes.py
+"""
+import sys
+
+from database import sync_db as db
+from services.indexes import INDEXES, QUERY_SHAPES, check_query_plans, ensure_indexes
+
+
+def main():
+    print("📦 Creando índices...")
+    ensure_indexes(db)
+    for collection_name, models in INDEXES.items():
+        print(f"   ✅ {collection_name}: {len(models)} índices")
+    print()
+
+    print(f"🔍 Verificando {len(QUERY_SHAPES)} consultas con explain()...")
+    problems = check_query_plans(db)
+    if problems:
+        for problem in problems:
+            print(f"   ❌ {problem}")
+        sys.exit(1)
+
+    print("   ✅ Todas las consultas usan índices sin ordenar en memoria")
+
+
+if __name__ == "__main__":
+    main()
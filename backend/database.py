@@ -1,53 +1,212 @@
+import asyncio
+import importlib.util
+import logging
 import os
-from pymongo import ASCENDING, MongoClient, ReturnDocument
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+from pymongo import MongoClient, ReturnDocument
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorClientSession, AsyncIOMotorDatabase
 from dotenv import load_dotenv
 import certifi
 
+from services.indexes import sync_indexes
+from services.metrics import command_metrics
+
 load_dotenv()
 
+T = TypeVar("T")
+logger = logging.getLogger(__name__)
+
 mongodb_uri: str = os.getenv("MONGODB_URI", "").strip()
 mongodb_db_name: str = os.getenv("MONGODB_DB", "la_tiendita").strip()
 mongodb_timeout_ms: int = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "15000"))
+mongodb_max_pool_size: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+mongodb_min_pool_size: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+mongodb_max_idle_time_ms: str = os.getenv("MONGODB_MAX_IDLE_TIME_MS", "").strip()
+# "zstd,snappy,zlib": se usa el primero que soporten cliente y servidor
+mongodb_compressors: str = os.getenv("MONGODB_COMPRESSORS", "").strip()
+mongodb_readonly_read_preference: str = os.getenv("MONGODB_READONLY_READ_PREFERENCE", "primary").strip()
+mongodb_max_staleness_seconds: int = int(os.getenv("MONGODB_MAX_STALENESS_SECONDS", "-1"))
 
 if not mongodb_uri:
     raise RuntimeError("Missing MONGODB_URI in environment configuration")
 
-mongo_client: MongoClient = MongoClient(
-    mongodb_uri,
-    serverSelectionTimeoutMS=mongodb_timeout_ms,
-    tls=True,
-    tlsCAFile=certifi.where(),
+_client_options = {
+    "serverSelectionTimeoutMS": mongodb_timeout_ms,
+    "tls": True,
+    "tlsCAFile": certifi.where(),
+    "maxPoolSize": mongodb_max_pool_size,
+    "minPoolSize": mongodb_min_pool_size,
+    # Conteo y duracion de comandos por coleccion y por peticion (/metrics)
+    "event_listeners": [command_metrics],
+}
+if mongodb_max_idle_time_ms:
+    _client_options["maxIdleTimeMS"] = int(mongodb_max_idle_time_ms)
+# Paquete que necesita cada compresor; zlib viene con Python
+_COMPRESSOR_PACKAGES = {"zstd": "zstandard", "snappy": "snappy"}
+
+
+def _split_compressors(spec: str) -> tuple[list[str], list[str]]:
+    """Separa los compresores configurados en (disponibles, sin paquete instalado)."""
+    available, missing = [], []
+    for name in (item.strip().lower() for item in spec.split(",")):
+        if not name:
+            continue
+        package = _COMPRESSOR_PACKAGES.get(name)
+        if package is None or importlib.util.find_spec(package) is not None:
+            available.append(name)
+        else:
+            missing.append(name)
+    return available, missing
+
+
+compressors_available, compressors_missing = _split_compressors(mongodb_compressors)
+if compressors_available:
+    # Solo se ofrecen los que pymongo puede usar; el servidor elige el primero que soporte
+    _client_options["compressors"] = ",".join(compressors_available)
+
+_READ_PREFERENCES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def _readonly_read_preference():
+    if mongodb_readonly_read_preference == "primary":
+        return Primary()
+    if mongodb_readonly_read_preference not in _READ_PREFERENCES:
+        raise RuntimeError(f"Invalid MONGODB_READONLY_READ_PREFERENCE: {mongodb_readonly_read_preference}")
+    return _READ_PREFERENCES[mongodb_readonly_read_preference](max_staleness=mongodb_max_staleness_seconds)
+
+# Cliente asincrono usado por los routers: no bloquea el event loop.
+mongo_client: AsyncIOMotorClient = AsyncIOMotorClient(mongodb_uri, **_client_options)
+db: AsyncIOMotorDatabase = mongo_client[mongodb_db_name]
+# Misma conexion, para lecturas que toleran datos con algunos segundos de retraso
+# (estadisticas, exportaciones): con secondaryPreferred no cargan al primario.
+read_db: AsyncIOMotorDatabase = mongo_client.get_database(
+    mongodb_db_name, read_preference=_readonly_read_preference()
 )
-mongo_client.admin.command("ping")
-db = mongo_client[mongodb_db_name]
 
+# Cliente sincrono para scripts de mantenimiento (seed, migraciones) e indices.
+# Ninguno de los dos clientes se conecta al importarse: la conexion se abre con la
+# primera operacion y la verificacion (ping) corre en segundo plano en init_database.
+sync_mongo_client: MongoClient = MongoClient(mongodb_uri, **_client_options)
+sync_db = sync_mongo_client[mongodb_db_name]
 
-def get_next_sequence(collection_name: str) -> int:
-    counter = db.counters.find_one_and_update(
+
+async def reserve_sequence(collection_name: str, count: int) -> range:
+    """Reserva count IDs consecutivos con un solo $inc sobre "counters"."""
+    counter = await db.counters.find_one_and_update(
         {"_id": collection_name},
-        {"$inc": {"seq": 1}},
+        {"$inc": {"seq": count}},
         upsert=True,
         return_document=ReturnDocument.AFTER,
     )
-    return int(counter["seq"])
+    last_id = int(counter["seq"])
+    return range(last_id - count + 1, last_id + 1)
+
+
+def reserve_sequence_sync(collection_name: str, count: int) -> range:
+    counter = sync_db.counters.find_one_and_update(
+        {"_id": collection_name},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    last_id = int(counter["seq"])
+    return range(last_id - count + 1, last_id + 1)
+
+
+class SequenceAllocator:
+    """Reparte en memoria bloques de IDs reservados en "counters".
+
+    Cada bloque se reserva con un $inc atomico, asi que varios workers nunca
+    reciben el mismo ID; los IDs sin usar de un bloque se pierden al reiniciar.
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = max(1, block_size)
+        self._blocks: dict[str, Iterator[int]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def next(self, collection_name: str) -> int:
+        lock = self._locks.setdefault(collection_name, asyncio.Lock())
+        async with lock:
+            block = self._blocks.get(collection_name)
+            next_id = next(block, None) if block is not None else None
+            if next_id is None:
+                block = iter(await reserve_sequence(collection_name, self.block_size))
+                self._blocks[collection_name] = block
+                next_id = next(block)
+            return next_id
+
+
+sequence_allocator = SequenceAllocator(int(os.getenv("MONGODB_SEQUENCE_BLOCK_SIZE", "20")))
+
+
+async def get_next_sequence(collection_name: str) -> int:
+    return await sequence_allocator.next(collection_name)
+
+
+def get_next_sequence_sync(collection_name: str) -> int:
+    return reserve_sequence_sync(collection_name, 1)[0]
+
+
+_transactions_supported: Optional[bool] = None
+
+
+async def _supports_transactions() -> bool:
+    """Las transacciones solo existen en replica sets o clusters sharded (Atlas)."""
+    global _transactions_supported
+    if _transactions_supported is None:
+        hello = await mongo_client.admin.command("hello")
+        _transactions_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+    return _transactions_supported
+
+
+async def run_in_transaction(callback: Callable[[Optional[AsyncIOMotorClientSession]], Awaitable[T]]) -> T:
+    """Ejecuta callback(session) en una transaccion; en un servidor standalone usa session=None."""
+    if not await _supports_transactions():
+        return await callback(None)
+
+    async with await mongo_client.start_session() as session:
+        return await session.with_transaction(callback)
+
+
+_PING_RETRY_SECONDS = 5
+
+# Estado que reporta /health: la API esta lista cuando Mongo responde y los indices terminaron
+startup_state: dict[str, Optional[str]] = {"mongo": "pendiente", "indices": "pendiente", "error": None}
 
 
-def _initialize_indexes() -> None:
-    collections_with_numeric_id = [
-        "cajas",
-        "products",
-        "transactions",
-        "debtors",
-        "cash_operations",
-    ]
-    for collection in collections_with_numeric_id:
-        db[collection].create_index([("id", ASCENDING)], unique=True)
+async def init_database() -> None:
+    """Verifica la conexion y crea los indices sin bloquear el arranque de la API.
 
-    db.cajas.create_index([("nombre", ASCENDING)], unique=True)
-    db.products.create_index([("name", ASCENDING)])
-    db.transactions.create_index([("fecha", ASCENDING)])
-    db.debtors.create_index([("deuda", ASCENDING)])
-    db.cash_operations.create_index([("fecha", ASCENDING)])
+    Se lanza como tarea desde el lifespan; el ping se reintenta hasta que Mongo responda
+    y los indices se crean en un hilo con el cliente sincrono (MONGODB_INDEX_MODE).
+    """
+    while True:
+        try:
+            await mongo_client.admin.command("ping")
+            break
+        except Exception as e:
+            startup_state.update(mongo="sin_conexion", error=str(e))
+            logger.warning("MongoDB no responde, se reintenta en %ss: %s", _PING_RETRY_SECONDS, e)
+            await asyncio.sleep(_PING_RETRY_SECONDS)
 
+    if compressors_missing:
+        logger.warning(
+            "MONGODB_COMPRESSORS: sin paquete instalado para %s (zstd: zstandard, snappy: python-snappy)",
+            ",".join(compressors_missing),
+        )
+    if mongodb_compressors:
+        logger.info("Compresion ofrecida a MongoDB: %s", ",".join(compressors_available) or "ninguna")
 
-_initialize_indexes()
+    startup_state.update(mongo="conectado", indices="creando", error=None)
+    try:
+        startup_state["indices"] = await asyncio.to_thread(sync_indexes, sync_db)
+    except Exception as e:
+        startup_state.update(indices="error", error=str(e))
+        logger.exception("No se pudieron crear los indices")
@@ -1,22 +1,50 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from database import init_database, startup_state
 from routers import products, transactions, debtors, cash, cajas
+from services.catalog_cache import watch_catalog_changes
+from services.idempotency import REPLAYED_HEADER, IdempotencyMiddleware
+from services.image_variants import shutdown_variant_pool
+from services.logging_config import configure_logging
+from services.metrics import METRICS_CONTENT_TYPE, MetricsMiddleware, metrics_registry
+from services.pagination import NEXT_CURSOR_HEADER
 from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Conexion e indices en segundo plano: la API acepta peticiones desde ya
+    database_init = asyncio.create_task(init_database())
+    catalog_watcher = asyncio.create_task(watch_catalog_changes())
+    yield
+    for task in (catalog_watcher, database_init):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    shutdown_variant_pool()
+
 
 app = FastAPI(
     title="La Tiendita API",
     description="Point of Sale API for La Tiendita",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 uploads_dir = Path(__file__).resolve().parent / "uploads"
 uploads_dir.mkdir(parents=True, exist_ok=True)
 app.mount("/static", StaticFiles(directory=str(uploads_dir)), name="static")
 
+# Reintentos con Idempotency-Key reciben la respuesta original
+app.add_middleware(IdempotencyMiddleware)
+
 # CORS configuration - Allow all origins for production
 app.add_middleware(
     CORSMiddleware,
@@ -24,8 +52,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", REPLAYED_HEADER],
 )
 
+# Ultimo en agregarse = mas externo: mide la peticion completa
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(cajas.router, prefix="/api/cajas", tags=["cajas"])
 app.include_router(products.router, prefix="/api/products", tags=["products"])
@@ -37,6 +69,19 @@ app.include_router(cash.router, prefix="/api/cash", tags=["cash"])
 async def root():
     return {"message": "La Tiendita API - Point of Sale System"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Latencia por ruta y comandos de MongoDB en formato Prometheus."""
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
+async def health_check(response: Response):
+    """Readiness: 503 mientras Mongo no responde o los indices se estan creando."""
+    if startup_state["mongo"] != "conectado" or startup_state["indices"] in ("pendiente", "creando"):
+        response.status_code = 503
+        status = "starting"
+    elif startup_state["indices"] == "error":
+        status = "degraded"
+    else:
+        status = "healthy"
+    return {"status": status, **startup_state}
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Script para fusionar deudores repetidos (mismo nombre, grupo y caja) antes de crear
+el índice único (nombre, grupo, caja_id). Conserva el ID más bajo, suma las deudas
+y mantiene la primera y la última fecha de compra.
+Ejecutar con las cajas cerradas: python merge_duplicate_debtors.py
+"""
+from pymongo import ASCENDING
+
+from database import sync_db as db
+from services.indexes import ensure_indexes
+
+
+def main():
+    duplicates = db.debtors.aggregate([
+        {"$sort": {"id": ASCENDING}},
+        {"$group": {
+            "_id": {"nombre": "$nombre", "grupo": "$grupo", "caja_id": {"$ifNull": ["$caja_id", None]}},
+            "ids": {"$push": "$id"},
+            "deuda": {"$sum": "$deuda"},
+            "fecha_primera_deuda": {"$min": "$fecha_primera_deuda"},
+            "ultima_compra": {"$max": "$ultima_compra"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ])
+
+    merged = 0
+    for group in duplicates:
+        keep_id, *remove_ids = group["ids"]
+        key = group["_id"]
+        db.debtors.update_one(
+            {"id": keep_id},
+            {"$set": {
+                "deuda": group["deuda"],
+                "caja_id": key["caja_id"],
+                "fecha_primera_deuda": group["fecha_primera_deuda"],
+                "ultima_compra": group["ultima_compra"],
+            }},
+        )
+        db.debtors.delete_many({"id": {"$in": remove_ids}})
+        merged += len(remove_ids)
+        print(f"   🔗 {key['nombre']} ({key['grupo']}, caja {key['caja_id']}): {len(group['ids'])} registros -> ID {keep_id}, deuda ${group['deuda']:.2f}")
+
+    print(f"✅ {merged} deudores repetidos fusionados")
+    print("📦 Creando índices...")
+    ensure_indexes(db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Script para fusionar productos repetidos (mismo nombre y caja) antes de crear
+el índice único (caja_id, name). Conserva el ID más bajo con sus datos y suma el stock
+de los repetidos; las ventas guardan nombre y precio, así que no se pierden.
+Ejecutar con las cajas cerradas: python merge_duplicate_products.py
+"""
+from pymongo import ASCENDING
+
+from database import sync_db as db
+from services.indexes import ensure_indexes
+
+
+def main():
+    duplicates = db.products.aggregate([
+        {"$sort": {"id": ASCENDING}},
+        {"$group": {
+            "_id": {"caja_id": {"$ifNull": ["$caja_id", None]}, "name": "$name"},
+            "ids": {"$push": "$id"},
+            "stock": {"$sum": {"$ifNull": ["$stock", 0]}},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ])
+
+    merged = 0
+    for group in duplicates:
+        keep_id, *remove_ids = group["ids"]
+        key = group["_id"]
+        db.products.update_one(
+            {"id": keep_id},
+            {"$set": {"stock": group["stock"], "caja_id": key["caja_id"]}},
+        )
+        db.products.delete_many({"id": {"$in": remove_ids}})
+        merged += len(remove_ids)
+        print(f"   🔗 {key['name']} (caja {key['caja_id']}): {len(group['ids'])} registros -> ID {keep_id}, stock {group['stock']}")
+
+    print(f"✅ {merged} productos repetidos fusionados")
+    print("📦 Creando índices...")
+    ensure_indexes(db)
+
+
+if __name__ == "__main__":
+    main()
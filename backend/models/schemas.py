@@ -45,11 +45,13 @@ class ProductUpdate(BaseModel):
 class Product(ProductBase):
     id: int
     created_at: datetime
+    image_variants: Optional[dict[str, str]] = None  # thumb/card/full -> URL
 
     class Config:
         from_attributes = True
 
 class ProductInTransaction(BaseModel):
+    producto_id: Optional[int] = None  # sin id la linea no descuenta stock
     nombre: str
     cantidad: int
     precio_unitario: float
@@ -68,6 +70,11 @@ class TransactionBase(BaseModel):
 class TransactionCreate(TransactionBase):
     pass
 
+class TransactionBatchItem(TransactionBase):
+    """Venta registrada offline por una terminal"""
+    idempotency_key: str = Field(..., min_length=1, max_length=100)
+    fecha: Optional[datetime] = None  # momento de la venta en la terminal
+
 class Transaction(TransactionBase):
     id: int
     fecha: datetime
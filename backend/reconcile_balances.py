@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""
+Script para reconstruir los saldos materializados (caja_balances) desde el libro de caja.
+Ejecutar con las cajas cerradas: python reconcile_balances.py
+"""
+import asyncio
+
+from database import db
+from services.cash_ledger import rebuild_balances
+
+
+async def main():
+    print("🔄 Reconstruyendo saldos de caja desde cash_operations...")
+    total = await rebuild_balances()
+    print(f"   ✅ {total} saldos reconstruidos")
+    print()
+
+    async for balance in db.caja_balances.find({}).sort("_id"):
+        print(f"   📦 Caja {balance['_id']}: ${float(balance['saldo']):.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
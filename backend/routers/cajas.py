@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import List, Optional
 from models.schemas import Caja, CajaCreate, CajaUpdate
 from database import db, get_next_sequence
 from datetime import datetime
-from pymongo import ASCENDING, DESCENDING
+from pymongo import ASCENDING
+from services.cash_ledger import get_balance
+from services.catalog_cache import catalog_response
 
 router = APIRouter()
 
@@ -15,7 +17,7 @@ async def get_cajas(activa_only: bool = False):
         if activa_only:
             mongo_filter["activa"] = True
 
-        cajas = list(db.cajas.find(mongo_filter, {"_id": 0}).sort("nombre", ASCENDING))
+        cajas = await db.cajas.find(mongo_filter, {"_id": 0}).sort("nombre", ASCENDING).to_list(length=None)
         return cajas
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -24,7 +26,7 @@ async def get_cajas(activa_only: bool = False):
 async def get_caja(caja_id: int):
     """Obtener una caja por ID"""
     try:
-        caja = db.cajas.find_one({"id": caja_id}, {"_id": 0})
+        caja = await db.cajas.find_one({"id": caja_id}, {"_id": 0})
 
         if not caja:
             raise HTTPException(status_code=404, detail="Caja no encontrada")
@@ -39,14 +41,14 @@ async def get_caja(caja_id: int):
 async def create_caja(caja: CajaCreate):
     """Crear una nueva caja"""
     try:
-        existing = db.cajas.find_one({"nombre": caja.nombre}, {"_id": 0, "id": 1})
+        existing = await db.cajas.find_one({"nombre": caja.nombre}, {"_id": 0, "id": 1})
         if existing:
             raise HTTPException(status_code=400, detail="Ya existe una caja con ese nombre")
 
         caja_dict = caja.model_dump()
-        caja_dict["id"] = get_next_sequence("cajas")
+        caja_dict["id"] = await get_next_sequence("cajas")
         caja_dict["created_at"] = datetime.utcnow()
-        db.cajas.insert_one(caja_dict)
+        await db.cajas.insert_one(caja_dict)
 
         if not caja_dict:
             raise HTTPException(status_code=400, detail="Error al crear la caja")
@@ -65,7 +67,7 @@ async def update_caja(caja_id: int, caja_update: CajaUpdate):
     """Actualizar una caja"""
     try:
         # Verificar que la caja existe
-        check = db.cajas.find_one({"id": caja_id}, {"_id": 0, "id": 1})
+        check = await db.cajas.find_one({"id": caja_id}, {"_id": 0, "id": 1})
         if not check:
             raise HTTPException(status_code=404, detail="Caja no encontrada")
 
@@ -74,8 +76,8 @@ async def update_caja(caja_id: int, caja_update: CajaUpdate):
         if not update_data:
             raise HTTPException(status_code=400, detail="No hay datos para actualizar")
 
-        db.cajas.update_one({"id": caja_id}, {"$set": update_data})
-        updated = db.cajas.find_one({"id": caja_id}, {"_id": 0})
+        await db.cajas.update_one({"id": caja_id}, {"$set": update_data})
+        updated = await db.cajas.find_one({"id": caja_id}, {"_id": 0})
 
         if not updated:
             raise HTTPException(status_code=400, detail="Error al actualizar la caja")
@@ -91,12 +93,12 @@ async def delete_caja(caja_id: int):
     """Eliminar una caja (soft delete - marcar como inactiva)"""
     try:
         # Verificar que la caja existe
-        check = db.cajas.find_one({"id": caja_id}, {"_id": 0, "id": 1})
+        check = await db.cajas.find_one({"id": caja_id}, {"_id": 0, "id": 1})
         if not check:
             raise HTTPException(status_code=404, detail="Caja no encontrada")
 
         # Marcar como inactiva en lugar de eliminar
-        result = db.cajas.update_one({"id": caja_id}, {"$set": {"activa": False}})
+        result = await db.cajas.update_one({"id": caja_id}, {"$set": {"activa": False}})
 
         if result.matched_count == 0:
             raise HTTPException(status_code=400, detail="Error al desactivar la caja")
@@ -112,22 +114,12 @@ async def get_caja_saldo(caja_id: int):
     """Obtener el saldo actual de una caja"""
     try:
         # Verificar que la caja existe
-        caja_info = db.cajas.find_one({"id": caja_id}, {"_id": 0, "id": 1, "nombre": 1, "saldo_inicial": 1})
+        caja_info = await db.cajas.find_one({"id": caja_id}, {"_id": 0, "id": 1, "nombre": 1, "saldo_inicial": 1})
         if not caja_info:
             raise HTTPException(status_code=404, detail="Caja no encontrada")
 
-        # Obtener la última operación de caja
-        result = db.cash_operations.find_one(
-            {"caja_id": caja_id},
-            {"_id": 0, "saldo": 1},
-            sort=[("fecha", DESCENDING), ("id", DESCENDING)],
-        )
-
-        if result:
-            saldo = result["saldo"]
-        else:
-            # Si no hay operaciones, usar el saldo inicial
-            saldo = caja_info["saldo_inicial"]
+        # Saldo materializado de la caja (cae al saldo inicial si no hay operaciones)
+        saldo, _ = await get_balance(caja_id)
 
         return {
             "caja_id": caja_id,
@@ -140,17 +132,15 @@ async def get_caja_saldo(caja_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{caja_id}/productos")
-async def get_productos_por_caja(caja_id: int):
+async def get_productos_por_caja(request: Request, caja_id: int):
     """Obtener todos los productos de una caja específica"""
     try:
         # Verificar que la caja existe
-        check = db.cajas.find_one({"id": caja_id}, {"_id": 0, "id": 1})
+        check = await db.cajas.find_one({"id": caja_id}, {"_id": 0, "id": 1})
         if not check:
             raise HTTPException(status_code=404, detail="Caja no encontrada")
 
-        result = list(db.products.find({"caja_id": caja_id}, {"_id": 0}).sort("name", ASCENDING))
-
-        return result
+        return await catalog_response(request, caja_id)
     except HTTPException:
         raise
     except Exception as e:
@@ -1,11 +1,17 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
 from typing import List, Optional
 from models.schemas import CashOperation, CashOperationCreate
-from database import db, get_next_sequence
+from database import db, get_next_sequence, read_db, run_in_transaction
+from services.cash_ledger import cash_delta, get_balance, get_total_balance, record_cash_operation
+from services.exporting import stream_export
+from services.pagination import NEXT_CURSOR_HEADER, encode_cursor, keyset_filter
+from services.rollups import CASH_FIELDS, find_rollups, sum_fields
 from datetime import datetime
+import logging
 from pymongo import DESCENDING
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 def _parse_date(value: Optional[str]) -> Optional[datetime]:
@@ -13,72 +19,95 @@ def _parse_date(value: Optional[str]) -> Optional[datetime]:
         return None
     return datetime.fromisoformat(value.replace("Z", "+00:00"))
 
+LIST_SORT = [("fecha", DESCENDING), ("id", DESCENDING)]
+EXPORT_COLUMNS = ["id", "fecha", "tipo_operacion", "monto", "saldo", "descripcion", "caja_id"]
+
+
+def _build_filter(
+    fecha_desde: Optional[str],
+    fecha_hasta: Optional[str],
+    tipo_operacion: Optional[str],
+    caja_id: Optional[int],
+) -> dict:
+    mongo_filter = {}
+    if fecha_desde:
+        mongo_filter.setdefault("fecha", {})["$gte"] = _parse_date(fecha_desde)
+    if fecha_hasta:
+        mongo_filter.setdefault("fecha", {})["$lte"] = _parse_date(fecha_hasta)
+    if tipo_operacion:
+        mongo_filter["tipo_operacion"] = tipo_operacion
+    if caja_id is not None:
+        mongo_filter["caja_id"] = caja_id
+    return mongo_filter
+
 @router.get("/", response_model=List[CashOperation])
 async def get_cash_operations(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     fecha_desde: Optional[str] = None,
     fecha_hasta: Optional[str] = None,
     tipo_operacion: Optional[str] = None,
-    caja_id: Optional[int] = None
+    caja_id: Optional[int] = None,
+    cursor: Optional[str] = Query(None, description="Token de X-Next-Cursor para paginar por keyset")
 ):
     """Obtener movimientos de caja con filtros opcionales"""
     try:
-        mongo_filter = {}
-        if fecha_desde:
-            mongo_filter.setdefault("fecha", {})["$gte"] = _parse_date(fecha_desde)
-        if fecha_hasta:
-            mongo_filter.setdefault("fecha", {})["$lte"] = _parse_date(fecha_hasta)
-        if tipo_operacion:
-            mongo_filter["tipo_operacion"] = tipo_operacion
-        if caja_id is not None:
-            mongo_filter["caja_id"] = caja_id
-
-        operations = list(
+        mongo_filter = _build_filter(fecha_desde, fecha_hasta, tipo_operacion, caja_id)
+        if cursor:
+            try:
+                mongo_filter = keyset_filter(mongo_filter, LIST_SORT, cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            skip = 0
+
+        operations = await (
             db.cash_operations.find(mongo_filter, {"_id": 0})
-            .sort([("fecha", DESCENDING), ("id", DESCENDING)])
+            .sort(LIST_SORT)
             .skip(skip)
             .limit(limit)
+            .to_list(length=None)
         )
+        if len(operations) == limit:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(operations[-1], LIST_SORT)
         return operations
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener operaciones: {str(e)}")
 
+@router.get("/export")
+async def export_cash_operations(
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    tipo_operacion: Optional[str] = None,
+    caja_id: Optional[int] = None
+):
+    """Exportar el libro de caja en NDJSON o CSV sin límite de página"""
+    try:
+        mongo_filter = _build_filter(fecha_desde, fecha_hasta, tipo_operacion, caja_id)
+        cursor = read_db.cash_operations.find(mongo_filter, {"_id": 0}).sort(LIST_SORT)
+        return stream_export(cursor, formato, EXPORT_COLUMNS, "movimientos_caja")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al exportar operaciones: {str(e)}")
+
 @router.get("/balance")
 async def get_current_balance(caja_id: Optional[int] = None):
     """Obtener saldo actual de caja (todas o una específica)"""
     try:
-        mongo_filter = {}
         if caja_id is not None:
-            mongo_filter["caja_id"] = caja_id
-
-        last_operation = db.cash_operations.find_one(
-            mongo_filter,
-            {"_id": 0},
-            sort=[("fecha", DESCENDING), ("id", DESCENDING)],
-        )
-
-        if not last_operation:
-            # Si no hay operaciones y es una caja específica, obtener saldo inicial
-            if caja_id is not None:
-                caja = db.cajas.find_one({"id": caja_id}, {"_id": 0, "saldo_inicial": 1, "nombre": 1})
-                if caja:
-                    return {
-                        "saldo": caja["saldo_inicial"],
-                        "ultima_actualizacion": None,
-                        "caja_id": caja_id,
-                        "caja_nombre": caja["nombre"]
-                    }
-            return {"saldo": 0, "ultima_actualizacion": None}
-
+            saldo, ultima_actualizacion = await get_balance(caja_id)
+        else:
+            saldo, ultima_actualizacion = await get_total_balance()
         result = {
-            "saldo": last_operation["saldo"],
-            "ultima_actualizacion": last_operation["fecha"]
+            "saldo": saldo,
+            "ultima_actualizacion": ultima_actualizacion
         }
 
         if caja_id is not None:
             result["caja_id"] = caja_id
-            caja = db.cajas.find_one({"id": caja_id}, {"_id": 0, "nombre": 1})
+            caja = await db.cajas.find_one({"id": caja_id}, {"_id": 0, "nombre": 1})
             if caja:
                 result["caja_nombre"] = caja["nombre"]
 
@@ -90,7 +119,7 @@ async def get_current_balance(caja_id: Optional[int] = None):
 async def get_cash_operation(operation_id: int):
     """Obtener una operación por ID"""
     try:
-        operation = db.cash_operations.find_one({"id": operation_id}, {"_id": 0})
+        operation = await db.cash_operations.find_one({"id": operation_id}, {"_id": 0})
         if not operation:
             raise HTTPException(status_code=404, detail="Operación no encontrada")
         return operation
@@ -103,41 +132,21 @@ async def get_cash_operation(operation_id: int):
 async def create_cash_operation(operation: CashOperationCreate):
     """Crear una nueva operación de caja (ingreso, egreso o ajuste)"""
     try:
-        # Obtener saldo actual de la caja específica
-        last_filter = {}
-        if operation.caja_id is not None:
-            last_filter["caja_id"] = operation.caja_id
-
-        last_operation = db.cash_operations.find_one(
-            last_filter,
-            {"_id": 0},
-            sort=[("fecha", DESCENDING), ("id", DESCENDING)],
-        )
-
-        # Si no hay operaciones previas y hay caja_id, usar saldo inicial de la caja
-        if not last_operation and operation.caja_id is not None:
-            caja = db.cajas.find_one({"id": operation.caja_id}, {"_id": 0, "saldo_inicial": 1})
-            current_balance = caja["saldo_inicial"] if caja else 0
-        else:
-            current_balance = last_operation["saldo"] if last_operation else 0
-
-        # Calcular nuevo saldo
-        if operation.tipo_operacion in ["INGRESO", "VENTA"]:
-            new_balance = current_balance + abs(operation.monto)
-        elif operation.tipo_operacion == "EGRESO":
-            new_balance = current_balance - abs(operation.monto)
-        else:  # AJUSTE
-            new_balance = current_balance + operation.monto
-        
-        # Crear operación
-        operation_dict = operation.model_dump()
-        operation_dict["saldo"] = new_balance
-        operation_dict["id"] = get_next_sequence("cash_operations")
-        operation_dict["fecha"] = datetime.utcnow()
-
-        db.cash_operations.insert_one(operation_dict)
-        operation_dict.pop("_id", None)
-        return operation_dict
+        operation_id = await get_next_sequence("cash_operations")
+        fecha = datetime.utcnow()
+
+        # El nuevo saldo sale de un $inc atómico sobre el saldo materializado de la caja
+        async def commit_operation(session):
+            operation_dict = operation.model_dump()
+            operation_dict["id"] = operation_id
+            operation_dict["fecha"] = fecha
+            return await record_cash_operation(
+                operation_dict,
+                cash_delta(operation.tipo_operacion, operation.monto),
+                session=session,
+            )
+
+        return await run_in_transaction(commit_operation)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al crear operación: {str(e)}")
 
@@ -190,54 +199,28 @@ async def get_daily_cash_stats(fecha: Optional[str] = None, caja_id: Optional[in
         if not fecha:
             fecha = datetime.now().strftime("%Y-%m-%d")
         
-        fecha_inicio = datetime.fromisoformat(f"{fecha}T00:00:00")
-        fecha_fin = datetime.fromisoformat(f"{fecha}T23:59:59")
-
-        print(f"[DEBUG] getDailyStats - fecha: {fecha}, caja_id: {caja_id}")
-        print(f"[DEBUG] Rango: {fecha_inicio} a {fecha_fin}")
+        datetime.fromisoformat(fecha)
 
-        current_day_filter = {"fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}}
-        if caja_id is not None:
-            current_day_filter["caja_id"] = caja_id
-        operations = list(db.cash_operations.find(current_day_filter, {"_id": 0}))
-
-        print(f"[DEBUG] Operaciones encontradas: {len(operations)}")
-        if operations:
-            print(f"[DEBUG] Primera operación: {operations[0]}")
-
-        ingresos = sum(op["monto"] for op in operations if op["tipo_operacion"] in ["INGRESO", "VENTA"] and op["monto"] > 0)
-        egresos = sum(abs(op["monto"]) for op in operations if op["tipo_operacion"] == "EGRESO")
-        ajustes = sum(op["monto"] for op in operations if op["tipo_operacion"] == "AJUSTE")
+        # Rollups desde el día pedido hasta hoy: el primero da los totales del día y
+        # la suma de todos los movimientos permite reconstruir el saldo de apertura.
+        rollups = await find_rollups(caja_id, fecha)
+        day_totals = sum_fields([r for r in rollups if r["fecha"] == fecha], CASH_FIELDS)
+        ingresos = day_totals["ingresos"]
+        egresos = day_totals["egresos"]
+        ajustes = day_totals["ajustes"]
 
-        print(f"[DEBUG] ingresos: {ingresos}, egresos: {egresos}, ajustes: {ajustes}")
+        logger.debug("Estadisticas de caja fecha=%s caja_id=%s ingresos=%s egresos=%s ajustes=%s",
+                     fecha, caja_id, ingresos, egresos, ajustes)
 
-        # Saldo al inicio del día
-        query_before = {"fecha": {"$lt": fecha_inicio}}
+        # Saldo actual (sin caja_id, la suma de todas las cajas)
         if caja_id is not None:
-            query_before["caja_id"] = caja_id
-        operation_before = db.cash_operations.find_one(
-            query_before,
-            {"_id": 0},
-            sort=[("fecha", DESCENDING), ("id", DESCENDING)],
-        )
-
-        # Si no hay operaciones previas y hay caja_id, usar saldo inicial de la caja
-        if not operation_before and caja_id is not None:
-            caja = db.cajas.find_one({"id": caja_id}, {"_id": 0, "saldo_inicial": 1})
-            saldo_inicial = caja["saldo_inicial"] if caja else 0
+            saldo_actual, _ = await get_balance(caja_id)
         else:
-            saldo_inicial = operation_before["saldo"] if operation_before else 0
+            saldo_actual, _ = await get_total_balance()
 
-        # Saldo actual
-        query_current = {}
-        if caja_id is not None:
-            query_current["caja_id"] = caja_id
-        current = db.cash_operations.find_one(
-            query_current,
-            {"_id": 0},
-            sort=[("fecha", DESCENDING), ("id", DESCENDING)],
-        )
-        saldo_actual = current["saldo"] if current else saldo_inicial
+        # Saldo al inicio del día
+        movimientos = sum_fields(rollups, CASH_FIELDS)
+        saldo_inicial = saldo_actual - (movimientos["ingresos"] - movimientos["egresos"] + movimientos["ajustes"])
 
         return {
             "fecha": fecha,
@@ -256,7 +239,7 @@ async def delete_cash_operation(operation_id: int):
     """Eliminar una operación de caja (requiere recalcular saldos)"""
     try:
         # Obtener la operación a eliminar
-        operation = db.cash_operations.find_one({"id": operation_id}, {"_id": 0})
+        operation = await db.cash_operations.find_one({"id": operation_id}, {"_id": 0})
         if not operation:
             raise HTTPException(status_code=404, detail="Operación no encontrada")
 
@@ -1,40 +1,30 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
 from typing import List, Optional
 from models.schemas import Debtor, DebtorCreate, DebtorUpdate, PaymentResponse
-from database import db, get_next_sequence
+from database import db, get_next_sequence, read_db, run_in_transaction
+from services.cash_ledger import record_cash_operation
+from services.debts import debtor_filter
+from services.search import normalize_name, prefix_filter
+from services.pagination import NEXT_CURSOR_HEADER, encode_cursor, keyset_filter
 from datetime import datetime
-from pymongo import DESCENDING
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 router = APIRouter()
 
+LIST_SORT = [("deuda", DESCENDING), ("id", DESCENDING)]
+# Busqueda por prefijo: orden que entrega el indice (nombre_norm, deuda, id)
+SEARCH_SORT = [("nombre_norm", ASCENDING), ("deuda", DESCENDING), ("id", DESCENDING)]
 
-def _current_balance(caja_id: Optional[int]) -> float:
-    balance_filter = {}
-    if caja_id is not None:
-        balance_filter["caja_id"] = caja_id
-
-    last_operation = db.cash_operations.find_one(
-        balance_filter,
-        {"_id": 0},
-        sort=[("fecha", DESCENDING), ("id", DESCENDING)],
-    )
-
-    if last_operation:
-        return float(last_operation.get("saldo", 0))
-
-    if caja_id is not None:
-        caja = db.cajas.find_one({"id": caja_id}, {"_id": 0, "saldo_inicial": 1})
-        if caja:
-            return float(caja.get("saldo_inicial", 0))
-
-    return 0.0
 
 @router.get("/", response_model=List[Debtor])
 async def get_all_debtors(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     grupo: Optional[str] = None,
-    nombre: Optional[str] = None
+    nombre: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Token de X-Next-Cursor para paginar por keyset")
 ):
     """Obtener todos los deudores con filtros opcionales"""
     try:
@@ -42,15 +32,29 @@ async def get_all_debtors(
         if grupo:
             mongo_filter["grupo"] = grupo
         if nombre:
-            mongo_filter["nombre"] = {"$regex": nombre, "$options": "i"}
-
-        debtors = list(
+            # Prefijo sin acentos ni mayusculas sobre nombre_norm (indexado)
+            mongo_filter["nombre_norm"] = prefix_filter(nombre)
+
+        sort = SEARCH_SORT if nombre else LIST_SORT
+        if cursor:
+            try:
+                mongo_filter = keyset_filter(mongo_filter, sort, cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            skip = 0
+
+        debtors = await (
             db.debtors.find(mongo_filter, {"_id": 0})
-            .sort("deuda", DESCENDING)
+            .sort(sort)
             .skip(skip)
             .limit(limit)
+            .to_list(length=None)
         )
+        if len(debtors) == limit:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(debtors[-1], sort)
         return debtors
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener deudores: {str(e)}")
 
@@ -58,7 +62,7 @@ async def get_all_debtors(
 async def get_debtor(debtor_id: int):
     """Obtener un deudor por ID"""
     try:
-        debtor = db.debtors.find_one({"id": debtor_id}, {"_id": 0})
+        debtor = await db.debtors.find_one({"id": debtor_id}, {"_id": 0})
         if not debtor:
             raise HTTPException(status_code=404, detail="Deudor no encontrado")
         return debtor
@@ -71,7 +75,7 @@ async def get_debtor(debtor_id: int):
 async def get_debtor_by_name(nombre: str, grupo: str):
     """Obtener un deudor por nombre y grupo"""
     try:
-        debtor = db.debtors.find_one({"nombre": nombre, "grupo": grupo}, {"_id": 0})
+        debtor = await db.debtors.find_one({"nombre": nombre, "grupo": grupo}, {"_id": 0})
         if not debtor:
             raise HTTPException(status_code=404, detail="Deudor no encontrado")
         return debtor
@@ -84,21 +88,24 @@ async def get_debtor_by_name(nombre: str, grupo: str):
 async def create_debtor(debtor: DebtorCreate):
     """Crear un nuevo deudor"""
     try:
-        # Verificar si ya existe
-        existing = db.debtors.find_one({"nombre": debtor.nombre, "grupo": debtor.grupo}, {"_id": 0})
+        # Verificar si ya existe (el indice unico cubre las altas concurrentes)
+        existing = await db.debtors.find_one(debtor_filter(debtor.nombre, debtor.grupo, debtor.caja_id), {"_id": 0, "id": 1})
         if existing:
             raise HTTPException(status_code=400, detail="El deudor ya existe")
 
         debtor_dict = debtor.model_dump()
         now = datetime.utcnow()
-        debtor_dict["id"] = get_next_sequence("debtors")
+        debtor_dict["id"] = await get_next_sequence("debtors")
         debtor_dict["fecha_primera_deuda"] = now
         debtor_dict["ultima_compra"] = now
-        db.debtors.insert_one(debtor_dict)
+        debtor_dict["nombre_norm"] = normalize_name(debtor.nombre)
+        await db.debtors.insert_one(debtor_dict)
         debtor_dict.pop("_id", None)
         return debtor_dict
     except HTTPException:
         raise
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="El deudor ya existe")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al crear deudor: {str(e)}")
 
@@ -110,61 +117,60 @@ async def pay_debt(
 ):
     """Registrar pago de deuda"""
     try:
-        # Obtener deudor actual
-        debtor = db.debtors.find_one({"id": debtor_id}, {"_id": 0})
-        if not debtor:
-            raise HTTPException(status_code=404, detail="Deudor no encontrado")
-
-        nueva_deuda = debtor["deuda"] - monto
-
-        if nueva_deuda < 0:
-            raise HTTPException(status_code=400, detail="El monto excede la deuda")
-
-        current_balance = _current_balance(caja_id)
-
-        # Si la deuda queda en 0, eliminar el deudor
-        if nueva_deuda == 0:
-            db.debtors.delete_one({"id": debtor_id})
+        cash_operation_id = await get_next_sequence("cash_operations")
+
+        async def commit_payment(session):
+            # Obtener deudor actual
+            debtor = await db.debtors.find_one({"id": debtor_id}, {"_id": 0}, session=session)
+            if not debtor:
+                raise HTTPException(status_code=404, detail="Deudor no encontrado")
+
+            nueva_deuda = debtor["deuda"] - monto
+
+            if nueva_deuda < 0:
+                raise HTTPException(status_code=400, detail="El monto excede la deuda")
+
+            # Si la deuda queda en 0, eliminar el deudor
+            if nueva_deuda == 0:
+                await db.debtors.delete_one({"id": debtor_id}, session=session)
+                descripcion = f"Pago de deuda - {debtor['nombre']} ({debtor['grupo']}) - Saldada completamente"
+                response = PaymentResponse(
+                    mensaje="Deuda saldada completamente",
+                    deuda_restante=0,
+                    debtor=None
+                )
+            else:
+                # Actualizar deuda
+                updated_debtor = await db.debtors.find_one_and_update(
+                    {"id": debtor_id},
+                    {"$set": {"deuda": nueva_deuda}},
+                    {"_id": 0, "nombre_norm": 0},
+                    return_document=ReturnDocument.AFTER,
+                    session=session,
+                )
+                descripcion = f"Pago parcial de deuda - {debtor['nombre']} ({debtor['grupo']}) - Resta ${nueva_deuda:.2f}"
+                response = PaymentResponse(
+                    mensaje="Pago registrado exitosamente",
+                    deuda_restante=nueva_deuda,
+                    debtor=updated_debtor
+                )
 
             # Registrar en caja el pago
-            cash_operation = {
-                "tipo_operacion": "INGRESO",
-                "monto": monto,
-                "saldo": current_balance + monto,
-                "descripcion": f"Pago de deuda - {debtor['nombre']} ({debtor['grupo']}) - Saldada completamente",
-                "caja_id": caja_id,
-                "id": get_next_sequence("cash_operations"),
-                "fecha": datetime.utcnow(),
-            }
-            db.cash_operations.insert_one(cash_operation)
-
-            return PaymentResponse(
-                mensaje="Deuda saldada completamente",
-                deuda_restante=0,
-                debtor=None
+            await record_cash_operation(
+                {
+                    "tipo_operacion": "INGRESO",
+                    "monto": monto,
+                    "descripcion": descripcion,
+                    "caja_id": caja_id,
+                    "id": cash_operation_id,
+                    "fecha": datetime.utcnow(),
+                },
+                monto,
+                session=session,
             )
-        else:
-            # Actualizar deuda
-            db.debtors.update_one({"id": debtor_id}, {"$set": {"deuda": nueva_deuda}})
-            updated_debtor = db.debtors.find_one({"id": debtor_id}, {"_id": 0})
+            return response
 
-            # Registrar en caja el pago
-            cash_operation = {
-                "tipo_operacion": "INGRESO",
-                "monto": monto,
-                "saldo": current_balance + monto,
-                "descripcion": f"Pago parcial de deuda - {debtor['nombre']} ({debtor['grupo']}) - Resta ${nueva_deuda:.2f}",
-                "caja_id": caja_id,
-                "id": get_next_sequence("cash_operations"),
-                "fecha": datetime.utcnow(),
-            }
-            db.cash_operations.insert_one(cash_operation)
-
-            return PaymentResponse(
-                mensaje="Pago registrado exitosamente",
-                deuda_restante=nueva_deuda,
-                debtor=updated_debtor
-            )
+        return await run_in_transaction(commit_payment)
     except HTTPException:
         raise
     except Exception as e:
@@ -174,7 +180,7 @@ async def pay_debt(
 async def update_debtor(debtor_id: int, debtor: DebtorUpdate):
     """Actualizar deuda manualmente"""
     try:
-        existing = db.debtors.find_one({"id": debtor_id})
+        existing = await db.debtors.find_one({"id": debtor_id})
         if not existing:
             raise HTTPException(status_code=404, detail="Deudor no encontrado")
 
@@ -182,8 +188,8 @@ async def update_debtor(debtor_id: int, debtor: DebtorUpdate):
         if not update_dict:
             raise HTTPException(status_code=400, detail="No hay campos para actualizar")
 
-        db.debtors.update_one({"id": debtor_id}, {"$set": update_dict})
-        updated = db.debtors.find_one({"id": debtor_id}, {"_id": 0})
+        await db.debtors.update_one({"id": debtor_id}, {"$set": update_dict})
+        updated = await db.debtors.find_one({"id": debtor_id}, {"_id": 0})
         return updated
     except HTTPException:
         raise
@@ -194,11 +200,11 @@ async def update_debtor(debtor_id: int, debtor: DebtorUpdate):
 async def delete_debtor(debtor_id: int):
     """Eliminar un deudor (condonar deuda)"""
     try:
-        existing = db.debtors.find_one({"id": debtor_id})
+        existing = await db.debtors.find_one({"id": debtor_id})
         if not existing:
             raise HTTPException(status_code=404, detail="Deudor no encontrado")
 
-        db.debtors.delete_one({"id": debtor_id})
+        await db.debtors.delete_one({"id": debtor_id})
         return None
     except HTTPException:
         raise
@@ -209,23 +215,20 @@ async def delete_debtor(debtor_id: int):
 async def get_debtors_summary():
     """Obtener resumen de deudas"""
     try:
-        debtors = list(db.debtors.find({}, {"_id": 0}))
-
-        total_deuda = sum(d["deuda"] for d in debtors)
+        # Agrupar por grupo en Mongo; los totales generales salen de las filas por grupo
+        rows = await read_db.debtors.aggregate([
+            {"$group": {"_id": "$grupo", "cantidad": {"$sum": 1}, "total": {"$sum": "$deuda"}}},
+            {"$sort": {"_id": 1}},
+        ]).to_list(length=None)
 
-        # Agrupar por grupo
-        grupos = {}
-        for debtor in debtors:
-            grupo = debtor["grupo"]
-            if grupo not in grupos:
-                grupos[grupo] = {"cantidad": 0, "total": 0}
-            grupos[grupo]["cantidad"] += 1
-            grupos[grupo]["total"] += debtor["deuda"]
+        grupos = {row["_id"]: {"cantidad": row["cantidad"], "total": row["total"]} for row in rows}
+        total_deudores = sum(row["cantidad"] for row in rows)
+        total_deuda = sum(row["total"] for row in rows)
 
         return {
-            "total_deudores": len(debtors),
+            "total_deudores": total_deudores,
             "total_deuda": total_deuda,
-            "promedio_deuda": total_deuda / len(debtors) if debtors else 0,
+            "promedio_deuda": total_deuda / total_deudores if total_deudores else 0,
             "por_grupo": grupos
         }
     except Exception as e:
@@ -1,19 +1,30 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse, RedirectResponse, Response
-from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, HTTPException, UploadFile, File, Query, Request
+from fastapi.responses import RedirectResponse
+from typing import List, Literal, Optional
 from models.schemas import Product, ProductCreate, ProductUpdate
 from database import db, get_next_sequence
-from pymongo import ASCENDING
+import logging
+import os
 import uuid
 from datetime import datetime
+from services.catalog_cache import catalog_cache, catalog_response
+from services.image_cache import image_cache, image_response, local_product_image
+from services.image_variants import VARIANT_CONTENT_TYPE, VARIANT_EXTENSION, build_variants, spool_to_disk
+from services.product_import import MAX_BULK_PRODUCTS, import_products, parse_rows
+from starlette.concurrency import run_in_threadpool
+from pymongo.errors import DuplicateKeyError
 from services.storage import (
+    SizeLimitedReader,
+    UploadTooLarge,
     save_product_image,
+    save_product_image_stream,
     delete_product_image,
-    get_local_product_image_path,
-    load_s3_product_image,
 )
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_UPLOAD_BYTES = int(float(os.getenv("MAX_IMAGE_UPLOAD_MB", "10")) * 1024 * 1024)
 
 
 def _serialize(doc: Optional[dict]) -> Optional[dict]:
@@ -23,15 +34,10 @@ def _serialize(doc: Optional[dict]) -> Optional[dict]:
     return doc
 
 @router.get("/", response_model=List[Product])
-async def get_all_products(caja_id: Optional[int] = None):
-    """Obtener todos los productos, opcionalmente filtrados por caja"""
+async def get_all_products(request: Request, caja_id: Optional[int] = None):
+    """Obtener todos los productos, opcionalmente filtrados por caja (cacheado, con ETag)"""
     try:
-        query = {}
-        if caja_id is not None:
-            query["caja_id"] = caja_id
-
-        products = list(db.products.find(query, {"_id": 0}).sort("name", ASCENDING))
-        return products
+        return await catalog_response(request, caja_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener productos: {str(e)}")
 
@@ -39,7 +45,7 @@ async def get_all_products(caja_id: Optional[int] = None):
 async def get_product(product_id: int):
     """Obtener un producto por ID"""
     try:
-        product = db.products.find_one({"id": product_id}, {"_id": 0})
+        product = await db.products.find_one({"id": product_id}, {"_id": 0})
         if not product:
             raise HTTPException(status_code=404, detail="Producto no encontrado")
         return product
@@ -50,29 +56,34 @@ async def get_product(product_id: int):
 
 
 @router.get("/{product_id}/image")
-async def get_product_image(product_id: int):
+async def get_product_image(
+    product_id: int,
+    request: Request,
+    size: Optional[Literal["thumb", "card", "full"]] = Query(None, description="Derivado a servir; sin size se envia el original"),
+):
     """Servir la imagen del producto mediante el backend para evitar URLs rotas o privadas."""
     try:
-        product = db.products.find_one({"id": product_id}, {"_id": 0})
+        product = await db.products.find_one({"id": product_id}, {"_id": 0, "image_url": 1, "image_variants": 1})
         if not product:
             raise HTTPException(status_code=404, detail="Producto no encontrado")
 
-        image_url = product.get("image_url")
+        # Productos subidos antes de los derivados solo tienen el original
+        image_url = (product.get("image_variants") or {}).get(size) or product.get("image_url")
         if not image_url:
             raise HTTPException(status_code=404, detail="Producto sin imagen")
 
         if image_url.startswith("http"):
             try:
-                content, content_type = load_s3_product_image(image_url)
-                return Response(content=content, media_type=content_type)
+                image = await image_cache.get(image_url)
             except Exception:
                 return RedirectResponse(url=image_url, status_code=307)
+            return image_response(request, image)
 
-        image_path = get_local_product_image_path(image_url)
-        if not image_path.exists():
+        image = await local_product_image(image_url)
+        if not image:
             raise HTTPException(status_code=404, detail="Archivo de imagen no encontrado")
 
-        return FileResponse(path=image_path)
+        return image_response(request, image)
     except HTTPException:
         raise
     except Exception as e:
@@ -83,24 +94,46 @@ async def create_product(product: ProductCreate):
     """Crear un nuevo producto"""
     try:
         product_dict = product.model_dump()
-        product_dict["id"] = get_next_sequence("products")
+        product_dict["id"] = await get_next_sequence("products")
         product_dict["created_at"] = datetime.utcnow()
-        print(f"[DEBUG] Creating product with data: {product_dict}")
-        db.products.insert_one(product_dict)
-        print("[DEBUG] Mongo insert completed")
+        await db.products.insert_one(product_dict)
+        catalog_cache.invalidate()
+        logger.info("Producto creado id=%s name=%r caja_id=%s", product_dict["id"], product.name, product.caja_id)
         return _serialize(product_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Ya existe un producto con ese nombre en la caja")
     except Exception as e:
-        print(f"[ERROR] Exception creating product: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error al crear producto name=%r", product.name)
         raise HTTPException(status_code=500, detail=f"Error al crear producto: {str(e)}")
 
+@router.post("/bulk")
+async def bulk_upsert_products(request: Request, caja_id: Optional[int] = Query(None, description="Caja para las filas que no indican caja_id")):
+    """Crear o actualizar productos en lote (JSON o CSV) por (caja_id, name), con reporte por fila"""
+    try:
+        body = await request.body()
+        try:
+            rows = parse_rows(body, request.headers.get("content-type", ""))
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HTTPException(status_code=400, detail=f"Carga inválida: {str(e)}")
+
+        if len(rows) > MAX_BULK_PRODUCTS:
+            raise HTTPException(status_code=413, detail=f"Máximo {MAX_BULK_PRODUCTS} productos por carga")
+
+        report = await import_products(rows, caja_id)
+        if report["creado"] or report["actualizado"]:
+            catalog_cache.invalidate()
+        return report
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en la carga masiva de productos: {str(e)}")
+
 @router.put("/{product_id}", response_model=Product)
 async def update_product(product_id: int, product: ProductUpdate):
     """Actualizar un producto existente"""
     try:
         # Verificar que existe
-        existing = db.products.find_one({"id": product_id})
+        existing = await db.products.find_one({"id": product_id})
         if not existing:
             raise HTTPException(status_code=404, detail="Producto no encontrado")
 
@@ -109,11 +142,14 @@ async def update_product(product_id: int, product: ProductUpdate):
         if not update_dict:
             raise HTTPException(status_code=400, detail="No hay campos para actualizar")
 
-        db.products.update_one({"id": product_id}, {"$set": update_dict})
-        updated = db.products.find_one({"id": product_id}, {"_id": 0})
+        await db.products.update_one({"id": product_id}, {"$set": update_dict})
+        catalog_cache.invalidate()
+        updated = await db.products.find_one({"id": product_id}, {"_id": 0})
         return updated
     except HTTPException:
         raise
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Ya existe un producto con ese nombre en la caja")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al actualizar producto: {str(e)}")
 
@@ -121,51 +157,97 @@ async def update_product(product_id: int, product: ProductUpdate):
 async def delete_product(product_id: int):
     """Eliminar un producto"""
     try:
-        existing = db.products.find_one({"id": product_id}, {"_id": 0})
+        existing = await db.products.find_one({"id": product_id}, {"_id": 0})
         if not existing:
             raise HTTPException(status_code=404, detail="Producto no encontrado")
 
-        # Eliminar imagen si existe
-        if existing.get("image_url"):
+        # Eliminar imagen y derivados si existen
+        image_urls = [existing.get("image_url"), *(existing.get("image_variants") or {}).values()]
+        for image_url in filter(None, image_urls):
             try:
-                delete_product_image(existing["image_url"])
+                await run_in_threadpool(delete_product_image, image_url)
             except:
                 pass  # Continuar aunque falle el borrado de imagen
 
-        db.products.delete_one({"id": product_id})
+        await db.products.delete_one({"id": product_id})
+        catalog_cache.invalidate()
         return None
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al eliminar producto: {str(e)}")
 
+async def _store_image_variants(product_id: int, base_name: str, image_url: str, source_path: str) -> None:
+    """Genera y guarda thumb/card/full despues de responder la subida; borra source_path al terminar."""
+    try:
+        image_variants = {}
+        for size_name, variant_bytes in (await build_variants(source_path)).items():
+            image_variants[size_name] = await run_in_threadpool(
+                save_product_image,
+                unique_name=f"{base_name}_{size_name}.{VARIANT_EXTENSION}",
+                file_bytes=variant_bytes,
+                content_type=VARIANT_CONTENT_TYPE,
+            )
+        if not image_variants:
+            return
+
+        # Si mientras tanto se subio otra imagen, estos derivados ya no aplican
+        result = await db.products.update_one(
+            {"id": product_id, "image_url": image_url},
+            {"$set": {"image_variants": image_variants}},
+        )
+        if result.matched_count:
+            catalog_cache.invalidate()
+        else:
+            for variant_url in image_variants.values():
+                await run_in_threadpool(delete_product_image, variant_url)
+    except Exception:
+        logger.exception("No se pudieron guardar los derivados de %s", image_url)
+    finally:
+        os.remove(source_path)
+
 @router.post("/upload-image/{product_id}")
-async def upload_product_image(product_id: int, file: UploadFile = File(...)):
+async def upload_product_image(product_id: int, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """Subir imagen para un producto"""
     try:
         # Verificar que el producto existe
-        existing = db.products.find_one({"id": product_id}, {"_id": 0})
+        existing = await db.products.find_one({"id": product_id}, {"_id": 0})
         if not existing:
             raise HTTPException(status_code=404, detail="Producto no encontrado")
 
         # Validar tipo de archivo
         if not file.content_type or not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="El archivo debe ser una imagen")
+        if file.size is not None and file.size > MAX_IMAGE_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="La imagen supera el tamaño máximo permitido")
 
         # Generar nombre único
         ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-        unique_name = f"{product_id}_{uuid.uuid4()}.{ext}"
-
-        # Guardar archivo en S3 (si esta configurado) o localmente como fallback
-        file_bytes = await file.read()
-        public_url = save_product_image(
-            unique_name=unique_name,
-            file_bytes=file_bytes,
-            content_type=file.content_type or "image/jpeg",
+        base_name = f"{product_id}_{uuid.uuid4()}"
+        unique_name = f"{base_name}.{ext}"
+
+        # Guardar en S3 (si esta configurado) o localmente, por bloques y fuera del event loop
+        try:
+            public_url = await run_in_threadpool(
+                save_product_image_stream,
+                unique_name=unique_name,
+                fileobj=SizeLimitedReader(file.file, MAX_IMAGE_UPLOAD_BYTES),
+                content_type=file.content_type or "image/jpeg",
+            )
+        except UploadTooLarge:
+            raise HTTPException(status_code=413, detail="La imagen supera el tamaño máximo permitido")
+
+        # Actualizar producto con nueva URL; los derivados anteriores ya no corresponden
+        await db.products.update_one(
+            {"id": product_id},
+            {"$set": {"image_url": public_url, "image_variants": None}},
         )
+        catalog_cache.invalidate()
 
-        # Actualizar producto con nueva URL
-        db.products.update_one({"id": product_id}, {"$set": {"image_url": public_url}})
+        # Derivados (thumb/card/full) en segundo plano, ya con la respuesta enviada; el
+        # worker lee la imagen de una copia en disco, el archivo subido se cierra al responder
+        source_path = await run_in_threadpool(spool_to_disk, file.file)
+        background_tasks.add_task(_store_image_variants, product_id, base_name, public_url, source_path)
 
         return {"image_url": public_url}
     except HTTPException:
@@ -1,11 +1,23 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
 from typing import List, Optional
-from models.schemas import Transaction, TransactionCreate
-from database import db, get_next_sequence
+from models.schemas import Transaction, TransactionBatchItem, TransactionCreate
+from database import db, get_next_sequence, read_db, run_in_transaction
+from services.cash_ledger import record_cash_operation
+from services.catalog_cache import catalog_cache
+from services.debts import add_debt
+from services.exporting import stream_export
+from services.pagination import NEXT_CURSOR_HEADER, encode_cursor, keyset_filter
+from services.search import normalize_name, prefix_filter
+from services.rollups import SALES_FIELDS, find_rollups, product_units, record_sale, sum_fields
+from services.stock import InsufficientStock, decrement_stock
+from services.transaction_batch import MAX_BATCH_TRANSACTIONS, ingest_batch
 from datetime import datetime
-from pymongo import DESCENDING
+import calendar
+import logging
+from pymongo import ASCENDING, DESCENDING
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 def _parse_date(value: Optional[str]) -> Optional[datetime]:
@@ -14,29 +26,50 @@ def _parse_date(value: Optional[str]) -> Optional[datetime]:
     return datetime.fromisoformat(value.replace("Z", "+00:00"))
 
 
-def _current_balance(caja_id: Optional[int]) -> float:
-    balance_filter = {}
+LIST_SORT = [("fecha", DESCENDING), ("id", DESCENDING)]
+# La busqueda por prefijo es un rango sobre cliente_norm: el indice
+# (cliente_norm, fecha, id) solo entrega los resultados en este orden sin ordenar en memoria
+SEARCH_SORT = [("cliente_norm", ASCENDING), ("fecha", DESCENDING), ("id", DESCENDING)]
+EXPORT_COLUMNS = ["id", "fecha", "cliente", "grupo", "caja_id", "total", "pago", "cambio", "pagado", "productos"]
+
+
+def _build_filter(
+    fecha_desde: Optional[str],
+    fecha_hasta: Optional[str],
+    cliente: Optional[str],
+    grupo: Optional[str],
+    caja_id: Optional[int],
+    pagado: Optional[str],
+) -> dict:
+    mongo_filter = {}
+    if fecha_desde:
+        mongo_filter.setdefault("fecha", {})["$gte"] = _parse_date(fecha_desde)
+    if fecha_hasta:
+        mongo_filter.setdefault("fecha", {})["$lte"] = _parse_date(fecha_hasta)
+    if cliente:
+        # Prefijo sin acentos ni mayusculas sobre cliente_norm (indexado)
+        mongo_filter["cliente_norm"] = prefix_filter(cliente)
+    if grupo:
+        mongo_filter["grupo"] = grupo
     if caja_id is not None:
-        balance_filter["caja_id"] = caja_id
+        mongo_filter["caja_id"] = caja_id
+    if pagado:
+        mongo_filter["pagado"] = pagado
+    return mongo_filter
 
-    last_operation = db.cash_operations.find_one(
-        balance_filter,
-        {"_id": 0},
-        sort=[("fecha", DESCENDING), ("id", DESCENDING)],
-    )
 
-    if last_operation:
-        return float(last_operation.get("saldo", 0))
-
-    if caja_id is not None:
-        caja = db.cajas.find_one({"id": caja_id}, {"_id": 0, "saldo_inicial": 1})
-        if caja:
-            return float(caja.get("saldo_inicial", 0))
-
-    return 0.0
+def _totals_by_caja(rollups: list) -> list:
+    por_caja = {}
+    for rollup in rollups:
+        por_caja.setdefault(rollup.get("caja_id"), []).append(rollup)
+    return [
+        {"caja_id": caja_id, **sum_fields(caja_rollups, SALES_FIELDS)}
+        for caja_id, caja_rollups in por_caja.items()
+    ]
 
 @router.get("/", response_model=List[Transaction])
 async def get_transactions(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     fecha_desde: Optional[str] = None,
@@ -44,39 +77,59 @@ async def get_transactions(
     cliente: Optional[str] = None,
     grupo: Optional[str] = None,
     caja_id: Optional[int] = None,
-    pagado: Optional[str] = None
+    pagado: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Token de X-Next-Cursor para paginar por keyset")
 ):
     """Obtener transacciones con filtros opcionales"""
     try:
-        mongo_filter = {}
-        if fecha_desde:
-            mongo_filter.setdefault("fecha", {})["$gte"] = _parse_date(fecha_desde)
-        if fecha_hasta:
-            mongo_filter.setdefault("fecha", {})["$lte"] = _parse_date(fecha_hasta)
-        if cliente:
-            mongo_filter["cliente"] = {"$regex": cliente, "$options": "i"}
-        if grupo:
-            mongo_filter["grupo"] = grupo
-        if caja_id is not None:
-            mongo_filter["caja_id"] = caja_id
-        if pagado:
-            mongo_filter["pagado"] = pagado
-
-        transactions = list(
+        mongo_filter = _build_filter(fecha_desde, fecha_hasta, cliente, grupo, caja_id, pagado)
+        sort = SEARCH_SORT if cliente else LIST_SORT
+        if cursor:
+            try:
+                mongo_filter = keyset_filter(mongo_filter, sort, cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            skip = 0
+
+        transactions = await (
             db.transactions.find(mongo_filter, {"_id": 0})
-            .sort([("fecha", DESCENDING), ("id", DESCENDING)])
+            .sort(sort)
             .skip(skip)
             .limit(limit)
+            .to_list(length=None)
         )
+        if len(transactions) == limit:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(transactions[-1], sort)
         return transactions
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener transacciones: {str(e)}")
 
+@router.get("/export")
+async def export_transactions(
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    fecha_desde: Optional[str] = None,
+    fecha_hasta: Optional[str] = None,
+    cliente: Optional[str] = None,
+    grupo: Optional[str] = None,
+    caja_id: Optional[int] = None,
+    pagado: Optional[str] = None
+):
+    """Exportar transacciones en NDJSON o CSV sin límite de página"""
+    try:
+        mongo_filter = _build_filter(fecha_desde, fecha_hasta, cliente, grupo, caja_id, pagado)
+        sort = SEARCH_SORT if cliente else LIST_SORT
+        cursor = read_db.transactions.find(mongo_filter, {"_id": 0, "cliente_norm": 0}).sort(sort)
+        return stream_export(cursor, formato, EXPORT_COLUMNS, "transacciones")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al exportar transacciones: {str(e)}")
+
 @router.get("/{transaction_id}", response_model=Transaction)
 async def get_transaction(transaction_id: int):
     """Obtener una transacción por ID"""
     try:
-        transaction = db.transactions.find_one({"id": transaction_id}, {"_id": 0})
+        transaction = await db.transactions.find_one({"id": transaction_id}, {"_id": 0})
         if not transaction:
             raise HTTPException(status_code=404, detail="Transacción no encontrada")
         return transaction
@@ -90,126 +143,144 @@ async def create_transaction(transaction: TransactionCreate):
     """Crear una nueva transacción"""
     try:
         transaction_dict = transaction.model_dump()
-        transaction_dict["id"] = get_next_sequence("transactions")
+        transaction_dict["id"] = await get_next_sequence("transactions")
         transaction_dict["fecha"] = datetime.utcnow()
-        print(f"[DEBUG] Transaction data received: {transaction_dict}")
-
-        # Registrar en transacciones
-        db.transactions.insert_one(transaction_dict)
-        created_transaction = dict(transaction_dict)
-        created_transaction.pop("_id", None)
+        transaction_dict["cliente_norm"] = normalize_name(transaction.cliente)
 
-        # Si no está pagado, registrar como deudor
+        # Los IDs se reservan fuera de la transacción para no serializar ventas en "counters"
+        cash_operation_id = None
+        if transaction.pago > 0:
+            cash_operation_id = await get_next_sequence("cash_operations")
+        debtor_id = None
         if transaction.pagado == "NO":
-            debtor_data = {
-                "nombre": transaction.cliente,
-                "grupo": transaction.grupo,
-                "deuda": transaction.total - transaction.pago,
-                "caja_id": transaction.caja_id
-            }
+            debtor_id = await get_next_sequence("debtors")
+
+        sold_products: list[int] = []
+
+        async def commit_sale(session):
+            nonlocal sold_products
+            # Descontar stock primero: si alguna linea no alcanza se rechaza la venta
+            sold_products = await decrement_stock(transaction_dict["productos"], session=session)
+
+            # Registrar en transacciones
+            await db.transactions.insert_one(dict(transaction_dict), session=session)
+
+            # Si no está pagado, registrar como deudor
+            if debtor_id is not None:
+                await add_debt(
+                    transaction.cliente,
+                    transaction.grupo,
+                    transaction.caja_id,
+                    transaction.total - transaction.pago,
+                    transaction_dict["fecha"],
+                    debtor_id,
+                    session=session,
+                )
 
-            # Verificar si el deudor ya existe
-            existing_filter = {"nombre": transaction.cliente, "grupo": transaction.grupo}
-            if transaction.caja_id is not None:
-                existing_filter["caja_id"] = transaction.caja_id
-            existing = db.debtors.find_one(existing_filter, {"_id": 0})
-
-            if existing:
-                # Actualizar deuda existente
-                new_debt = float(existing["deuda"]) + float(debtor_data["deuda"])
-                db.debtors.update_one(
-                    {"id": existing["id"]},
-                    {"$set": {"deuda": new_debt, "ultima_compra": created_transaction["fecha"]}},
+            # Registrar movimiento en caja solo si hay pago
+            cash_operation = None
+            if cash_operation_id is not None:
+                # Usar el TOTAL de la venta, no el pago
+                cash_operation = await record_cash_operation(
+                    {
+                        "tipo_operacion": "VENTA",
+                        "monto": transaction.total,
+                        "descripcion": f"Venta a {transaction.cliente} - {len(transaction.productos)} productos",
+                        "caja_id": transaction.caja_id,
+                        "id": cash_operation_id,
+                        "fecha": transaction_dict["fecha"],
+                    },
+                    transaction.total,
+                    session=session,
+                    record_rollup=False,
                 )
-            else:
-                # Crear nuevo deudor
-                debtor_data["id"] = get_next_sequence("debtors")
-                debtor_data["fecha_primera_deuda"] = created_transaction["fecha"]
-                debtor_data["ultima_compra"] = created_transaction["fecha"]
-                db.debtors.insert_one(debtor_data)
-
-        # Registrar movimiento en caja solo si hay pago
-        if transaction.pago > 0:
-            current_balance = _current_balance(transaction.caja_id)
-
-            # Usar el TOTAL de la venta, no el pago
-            cash_operation = {
-                "tipo_operacion": "VENTA",
-                "monto": transaction.total,  # Total de la venta, no el pago
-                "descripcion": f"Venta a {transaction.cliente} - {len(transaction.productos)} productos",
-                "caja_id": transaction.caja_id,
-                "saldo": current_balance + transaction.total,  # Sumar el total
-                "id": get_next_sequence("cash_operations"),
-                "fecha": created_transaction["fecha"],
-            }
 
-            db.cash_operations.insert_one(cash_operation)
+            # Venta y movimiento de caja comparten rollup (dia, caja): un solo update
+            await record_sale(transaction_dict, cash_operation, session=session)
 
-        return created_transaction
+        await run_in_transaction(commit_sale)
+        if sold_products:
+            catalog_cache.invalidate_products(sold_products)
+        logger.debug("Venta registrada id=%s total=%s pagado=%s", transaction_dict["id"], transaction.total, transaction.pagado)
+        return transaction_dict
+    except InsufficientStock as e:
+        raise HTTPException(status_code=409, detail={"mensaje": "Stock insuficiente", "faltantes": e.faltantes})
     except Exception as e:
-        print(f"[ERROR] Error creating transaction: {str(e)}")
-        print(f"[ERROR] Error type: {type(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error al crear transacción")
         raise HTTPException(status_code=500, detail=f"Error al crear transacción: {str(e)}")
 
+@router.post("/batch")
+async def create_transactions_batch(transactions: List[TransactionBatchItem]):
+    """Registrar en un solo paso las ventas offline de una terminal (idempotente por idempotency_key)"""
+    try:
+        if not transactions:
+            raise HTTPException(status_code=400, detail="El lote está vacío")
+        if len(transactions) > MAX_BATCH_TRANSACTIONS:
+            raise HTTPException(status_code=413, detail=f"Máximo {MAX_BATCH_TRANSACTIONS} ventas por lote")
+
+        return await ingest_batch(transactions)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al registrar el lote de transacciones: {str(e)}")
+
 @router.get("/stats/daily")
-async def get_daily_stats(fecha: Optional[str] = None):
+async def get_daily_stats(
+    fecha: Optional[str] = None,
+    caja_id: Optional[int] = None,
+    por_caja: bool = False
+):
     """Obtener estadísticas del día"""
     try:
         if not fecha:
             fecha = datetime.now().strftime("%Y-%m-%d")
-        
-        fecha_inicio = datetime.fromisoformat(f"{fecha}T00:00:00")
-        fecha_fin = datetime.fromisoformat(f"{fecha}T23:59:59")
-
-        # Transacciones del día
-        transactions = list(
-            db.transactions.find({"fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}}, {"_id": 0})
-        )
+        datetime.fromisoformat(fecha)
 
-        total_ventas = sum(t["total"] for t in transactions)
-        total_efectivo = sum(t["pago"] for t in transactions)
-        total_credito = sum(t["total"] - t["pago"] for t in transactions if t["pagado"] == "NO")
+        # Totales precalculados en daily_rollups
+        rollups = await find_rollups(caja_id, fecha, fecha, database=read_db)
+        totals = sum_fields(rollups, SALES_FIELDS)
 
-        return {
+        result = {
             "fecha": fecha,
-            "total_transacciones": len(transactions),
-            "total_ventas": total_ventas,
-            "total_efectivo": total_efectivo,
-            "total_credito": total_credito,
-            "promedio_ticket": total_ventas / len(transactions) if transactions else 0
+            **totals,
+            "promedio_ticket": totals["total_ventas"] / totals["total_transacciones"] if totals["total_transacciones"] else 0,
+            "productos_vendidos": product_units(rollups)
         }
+        if por_caja:
+            result["por_caja"] = _totals_by_caja(rollups)
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener estadísticas: {str(e)}")
 
 @router.get("/stats/monthly")
-async def get_monthly_stats(year: int = Query(...), month: int = Query(..., ge=1, le=12)):
+async def get_monthly_stats(
+    year: int = Query(...),
+    month: int = Query(..., ge=1, le=12),
+    caja_id: Optional[int] = None,
+    por_caja: bool = False
+):
     """Obtener estadísticas del mes"""
     try:
-        fecha_inicio = datetime.fromisoformat(f"{year}-{month:02d}-01T00:00:00")
-
-        # Calcular último día del mes
-        if month == 12:
-            next_month = datetime.fromisoformat(f"{year + 1}-01-01T00:00:00")
-        else:
-            next_month = datetime.fromisoformat(f"{year}-{month + 1:02d}-01T00:00:00")
-
-        transactions = list(
-            db.transactions.find({"fecha": {"$gte": fecha_inicio, "$lt": next_month}}, {"_id": 0})
+        days_in_month = calendar.monthrange(year, month)[1]
+        rollups = await find_rollups(
+            caja_id,
+            f"{year}-{month:02d}-01",
+            f"{year}-{month:02d}-{days_in_month:02d}",
+            database=read_db,
         )
+        totals = sum_fields(rollups, SALES_FIELDS)
 
-        total_ventas = sum(t["total"] for t in transactions)
-        total_efectivo = sum(t["pago"] for t in transactions)
-
-        return {
+        result = {
             "year": year,
             "month": month,
-            "total_transacciones": len(transactions),
-            "total_ventas": total_ventas,
-            "total_efectivo": total_efectivo,
-            "promedio_diario": total_ventas / 30 if transactions else 0
+            "total_transacciones": totals["total_transacciones"],
+            "total_ventas": totals["total_ventas"],
+            "total_efectivo": totals["total_efectivo"],
+            "promedio_diario": totals["total_ventas"] / days_in_month
         }
+        if por_caja:
+            result["por_caja"] = _totals_by_caja(rollups)
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener estadísticas mensuales: {str(e)}")
 
@@ -234,46 +305,70 @@ async def get_transactions_by_teacher(
         if only_unpaid:
             mongo_filter["pagado"] = "NO"
 
-        transactions = list(
+        transactions = await (
             db.transactions.find(mongo_filter, {"_id": 0})
             .sort([("fecha", DESCENDING), ("id", DESCENDING)])
             .skip(skip)
             .limit(limit)
+            .to_list(length=None)
         )
         return transactions
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener transacciones del maestro: {str(e)}")
 
 @router.get("/by-teacher/{teacher_name}/summary")
-async def get_teacher_summary(teacher_name: str):
+async def get_teacher_summary(
+    teacher_name: str,
+    skip: int = Query(0, ge=0, description="Desplazamiento en la lista de transacciones sin pagar"),
+    limit: int = Query(100, ge=1, le=1000, description="Tamaño de página de la lista sin pagar")
+):
     """Obtener resumen de transacciones de un maestro"""
     try:
-        # Obtener todas las transacciones del maestro
-        transactions = list(db.transactions.find({"cliente": teacher_name}, {"_id": 0}))
-
-        if not transactions:
+        # Totales y página de pendientes en una sola agregación; el orden usa el índice (cliente, fecha, id)
+        pipeline = [
+            {"$match": {"cliente": teacher_name}},
+            {"$sort": {"fecha": DESCENDING, "id": DESCENDING}},
+            {"$facet": {
+                "totales": [
+                    {"$group": {
+                        "_id": None,
+                        "grupo": {"$first": "$grupo"},
+                        "total_transactions": {"$sum": 1},
+                        "total_amount": {"$sum": "$total"},
+                        "total_paid": {"$sum": "$pago"},
+                        "total_pending": {"$sum": {
+                            "$cond": [{"$eq": ["$pagado", "NO"]}, {"$subtract": ["$total", "$pago"]}, 0]
+                        }},
+                        "total_unpaid": {"$sum": {"$cond": [{"$eq": ["$pagado", "NO"]}, 1, 0]}},
+                    }},
+                ],
+                "unpaid_transactions": [
+                    {"$match": {"pagado": "NO"}},
+                    {"$skip": skip},
+                    {"$limit": limit},
+                    {"$project": {"_id": 0, "cliente_norm": 0}},
+                ],
+            }},
+        ]
+        result = (await read_db.transactions.aggregate(pipeline).to_list(length=1))[0]
+
+        if not result["totales"] or not result["totales"][0]["total_transactions"]:
             return {
                 "teacher_name": teacher_name,
                 "total_transactions": 0,
                 "total_amount": 0,
                 "total_paid": 0,
                 "total_pending": 0,
+                "total_unpaid": 0,
                 "unpaid_transactions": []
             }
 
-        total_amount = sum(t["total"] for t in transactions)
-        total_paid = sum(t["pago"] for t in transactions)
-        total_pending = sum(t["total"] - t["pago"] for t in transactions if t["pagado"] == "NO")
-        unpaid_transactions = [t for t in transactions if t["pagado"] == "NO"]
-
+        totales = result["totales"][0]
+        totales.pop("_id")
         return {
             "teacher_name": teacher_name,
-            "grupo": transactions[0]["grupo"] if transactions else "",
-            "total_transactions": len(transactions),
-            "total_amount": total_amount,
-            "total_paid": total_paid,
-            "total_pending": total_pending,
-            "unpaid_transactions": unpaid_transactions
+            **totales,
+            "unpaid_transactions": result["unpaid_transactions"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener resumen del maestro: {str(e)}")
@@ -2,7 +2,7 @@
 """
 Script para preparar datos base del sistema multi-caja en MongoDB.
 """
-from database import db, get_next_sequence
+from database import sync_db as db, get_next_sequence_sync as get_next_sequence
 from datetime import datetime
 from pymongo import ASCENDING
 
@@ -2,16 +2,19 @@
 Script para insertar datos de prueba en MongoDB
 Ejecutar: python seed_data.py
 """
+import asyncio
 import sys
 from pathlib import Path
 from datetime import datetime
-from pymongo import DESCENDING
 
 # Agregar el directorio backend al path
 backend_dir = Path(__file__).parent
 sys.path.insert(0, str(backend_dir))
 
-from database import db, get_next_sequence
+from database import sync_db as db, get_next_sequence_sync as get_next_sequence, reserve_sequence_sync
+from services.cash_ledger import record_cash_operation
+from services.rollups import record_sale
+from services.search import normalize_name
 
 def seed_products():
     """Insertar productos de prueba"""
@@ -30,10 +33,13 @@ def seed_products():
             {"name": "Aceite 900ml", "price": 3.50},
         ]
 
+        # Reservar todos los IDs en una sola operacion
+        product_ids = reserve_sequence_sync("products", len(raw_products))
+
         products = []
-        for p in raw_products:
+        for product_id, p in zip(product_ids, raw_products):
             p_doc = {
-                "id": get_next_sequence("products"),
+                "id": product_id,
                 "name": p["name"],
                 "price": p["price"],
                 "stock": 0,
@@ -50,8 +56,8 @@ def seed_products():
         print(f"❌ Error al insertar productos: {e}")
         return None
 
-def seed_cash_initial():
-    """Insertar saldo inicial de caja"""
+async def seed_cash_initial():
+    """Insertar saldo inicial de caja (actualiza caja_balances y daily_rollups como la API)"""
     try:
         # Verificar si ya existe un saldo
         existing = db.cash_operations.find_one({}, {"_id": 0})
@@ -60,24 +66,25 @@ def seed_cash_initial():
             return existing
 
         # Crear saldo inicial
-        initial_cash = {
-            "id": get_next_sequence("cash_operations"),
-            "tipo_operacion": "AJUSTE",
-            "monto": 100.00,
-            "saldo": 100.00,
-            "descripcion": "Saldo inicial de caja",
-            "caja_id": None,
-            "fecha": datetime.utcnow(),
-        }
-        db.cash_operations.insert_one(initial_cash)
+        initial_cash = await record_cash_operation(
+            {
+                "id": get_next_sequence("cash_operations"),
+                "tipo_operacion": "AJUSTE",
+                "monto": 100.00,
+                "descripcion": "Saldo inicial de caja",
+                "caja_id": None,
+                "fecha": datetime.utcnow(),
+            },
+            100.00,
+        )
         print(f"✅ Saldo inicial de caja: ${initial_cash['saldo']}")
         return initial_cash
     except Exception as e:
         print(f"❌ Error al insertar saldo inicial: {e}")
         return None
 
-def seed_sample_transaction():
-    """Crear una transacción de ejemplo"""
+async def seed_sample_transaction():
+    """Crear una transacción de ejemplo (actualiza caja_balances y daily_rollups como la API)"""
     try:
         # Obtener algunos productos
         products = list(db.products.find({}, {"_id": 0}).limit(3))
@@ -90,6 +97,7 @@ def seed_sample_transaction():
         transaction = {
             "id": get_next_sequence("transactions"),
             "cliente": "Cliente de Prueba",
+            "cliente_norm": normalize_name("Cliente de Prueba"),
             "grupo": "General",
             "productos": [
                 {
@@ -113,23 +121,22 @@ def seed_sample_transaction():
             "fecha": now,
         }
 
-        db.transactions.insert_one(transaction)
-
-        # Actualizar caja
-        last_cash = db.cash_operations.find_one({}, {"_id": 0}, sort=[("fecha", DESCENDING), ("id", DESCENDING)])
-        current_balance = float(last_cash["saldo"]) if last_cash else 0.0
-        new_balance = current_balance + transaction["pago"]
+        db.transactions.insert_one(dict(transaction))
 
-        cash_op = {
-            "id": get_next_sequence("cash_operations"),
-            "tipo_operacion": "VENTA",
-            "monto": transaction["pago"],
-            "saldo": new_balance,
-            "descripcion": f"Venta de prueba - {len(transaction['productos'])} productos",
-            "caja_id": None,
-            "fecha": now,
-        }
-        db.cash_operations.insert_one(cash_op)
+        # Actualizar caja con el saldo materializado y los rollups del día
+        cash_op = await record_cash_operation(
+            {
+                "id": get_next_sequence("cash_operations"),
+                "tipo_operacion": "VENTA",
+                "monto": transaction["pago"],
+                "descripcion": f"Venta de prueba - {len(transaction['productos'])} productos",
+                "caja_id": None,
+                "fecha": now,
+            },
+            transaction["pago"],
+            record_rollup=False,
+        )
+        await record_sale(transaction, cash_op)
 
         print(f"✅ Transacción de prueba creada: ${transaction['total']}")
         return transaction
@@ -137,7 +144,7 @@ def seed_sample_transaction():
         print(f"❌ Error al crear transacción: {e}")
         return None
 
-def main():
+async def main():
     print("🌱 Insertando datos de prueba en MongoDB...\n")
     
     # 1. Productos
@@ -146,11 +153,11 @@ def main():
     
     # 2. Saldo inicial
     print("\n💰 Configurando caja...")
-    seed_cash_initial()
+    await seed_cash_initial()
     
     # 3. Transacción de ejemplo
     print("\n🛒 Creando transacción de prueba...")
-    seed_sample_transaction()
+    await seed_sample_transaction()
     
     print("\n✨ ¡Datos de prueba insertados correctamente!")
     print("\n📊 Puedes verificar en:")
@@ -158,4 +165,4 @@ def main():
     print("   - MongoDB: revisa la base configurada en MONGODB_DB")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,198 @@
+from datetime import datetime
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClientSession
+from pymongo import ReplaceOne, ReturnDocument
+
+from database import db
+from services.rollups import record_cash
+
+GENERAL_BALANCE_KEY = "general"
+
+
+def _balance_key(caja_id: Optional[int]):
+    return caja_id if caja_id is not None else GENERAL_BALANCE_KEY
+
+
+def cash_delta(tipo_operacion: str, monto: float) -> float:
+    """Efecto de una operacion sobre el saldo de la caja."""
+    if tipo_operacion in ["INGRESO", "VENTA"]:
+        return abs(monto)
+    if tipo_operacion == "EGRESO":
+        return -abs(monto)
+    return monto  # AJUSTE
+
+
+# Mismas reglas que cash_delta, para sumar el libro dentro de un $group
+_DELTA_EXPRESSION = {"$switch": {
+    "branches": [
+        {"case": {"$in": ["$tipo_operacion", ["INGRESO", "VENTA"]]}, "then": {"$abs": "$monto"}},
+        {"case": {"$eq": ["$tipo_operacion", "EGRESO"]}, "then": {"$multiply": [-1, {"$abs": "$monto"}]}},
+    ],
+    "default": "$monto",
+}}
+
+_SUM_DELTAS = {
+    "movimientos": {"$sum": _DELTA_EXPRESSION},
+    "ultima_actualizacion": {"$max": "$fecha"},
+}
+
+
+async def _initial_balance(caja_id: Optional[int], session: Optional[AsyncIOMotorClientSession] = None) -> float:
+    if caja_id is None:
+        return 0.0
+    caja = await db.cajas.find_one({"id": caja_id}, {"_id": 0, "saldo_inicial": 1}, session=session)
+    return float(caja.get("saldo_inicial", 0)) if caja else 0.0
+
+
+async def _ledger_balance(
+    caja_id: Optional[int],
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> tuple[float, Optional[datetime]]:
+    """Saldo inicial de la caja mas la suma de los movimientos del libro.
+
+    No se toma el saldo de la ultima fila: los $inc concurrentes no siguen el orden de
+    fecha ni de id, asi que esa fila puede no incluir operaciones aplicadas despues.
+    """
+    totals = await db.cash_operations.aggregate(
+        [{"$match": {"caja_id": caja_id}}, {"$group": {"_id": None, **_SUM_DELTAS}}],
+        session=session,
+    ).to_list(length=1)
+
+    saldo = await _initial_balance(caja_id, session=session)
+    if totals:
+        return saldo + float(totals[0]["movimientos"]), totals[0]["ultima_actualizacion"]
+    return saldo, None
+
+
+async def get_balance(caja_id: Optional[int]) -> tuple[float, Optional[datetime]]:
+    """Saldo actual de la caja y su ultima actualizacion con una busqueda por _id."""
+    balance = await db.caja_balances.find_one({"_id": _balance_key(caja_id)})
+    if balance is not None:
+        return float(balance["saldo"]), balance.get("ultima_actualizacion")
+
+    # Caja sin operaciones desde que existe el saldo materializado
+    return await _ledger_balance(caja_id)
+
+
+async def get_total_balance() -> tuple[float, Optional[datetime]]:
+    """Suma de los saldos de todas las cajas y de las operaciones sin caja.
+
+    Las que todavia no tienen saldo materializado se calculan desde el libro, como en get_balance.
+    """
+    saldo = 0.0
+    ultima_actualizacion = None
+    keys = set()
+
+    def add(caja_saldo: float, fecha: Optional[datetime]) -> None:
+        nonlocal saldo, ultima_actualizacion
+        saldo += caja_saldo
+        if fecha and (ultima_actualizacion is None or fecha > ultima_actualizacion):
+            ultima_actualizacion = fecha
+
+    async for balance in db.caja_balances.find({}):
+        keys.add(balance["_id"])
+        add(float(balance["saldo"]), balance.get("ultima_actualizacion"))
+
+    missing = [caja["id"] async for caja in db.cajas.find({"id": {"$nin": list(keys)}}, {"_id": 0, "id": 1})]
+    if GENERAL_BALANCE_KEY not in keys:
+        missing.append(None)
+    for caja_id in missing:
+        add(*await _ledger_balance(caja_id))
+
+    return saldo, ultima_actualizacion
+
+
+async def apply_cash_delta(
+    caja_id: Optional[int],
+    delta: float,
+    fecha: datetime,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> float:
+    """Suma delta al saldo materializado de la caja con un unico $inc y devuelve el nuevo saldo."""
+    key = _balance_key(caja_id)
+    update = {"$inc": {"saldo": delta}, "$set": {"ultima_actualizacion": fecha}}
+
+    balance = await db.caja_balances.find_one_and_update(
+        {"_id": key},
+        update,
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+    if balance is None:
+        # Primera operacion desde que existe el saldo materializado: partir del libro.
+        initial, _ = await _ledger_balance(caja_id, session=session)
+        await db.caja_balances.update_one(
+            {"_id": key},
+            {"$setOnInsert": {"caja_id": caja_id, "saldo": initial}},
+            upsert=True,
+            session=session,
+        )
+        balance = await db.caja_balances.find_one_and_update(
+            {"_id": key},
+            update,
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+
+    return float(balance["saldo"])
+
+
+async def record_cash_operation(
+    operation: dict,
+    delta: float,
+    session: Optional[AsyncIOMotorClientSession] = None,
+    record_rollup: bool = True,
+) -> dict:
+    """Aplica delta al saldo de la caja e inserta la operacion con el saldo resultante.
+
+    Con record_rollup=False el llamador suma la operacion al rollup (p. ej. junto con su venta).
+    """
+    operation["saldo"] = await apply_cash_delta(
+        operation.get("caja_id"),
+        delta,
+        operation["fecha"],
+        session=session,
+    )
+    await db.cash_operations.insert_one(operation, session=session)
+    if record_rollup:
+        await record_cash(operation, session=session)
+    operation.pop("_id", None)
+    return operation
+
+
+async def rebuild_balances() -> int:
+    """Reconstruye caja_balances desde el libro de caja. Ejecutar sin ventas en curso.
+
+    Cada saldo es el saldo inicial de la caja (0 para las operaciones sin caja) mas la
+    suma de sus movimientos, que no depende del orden en que se aplicaron los $inc.
+    """
+    initial = {
+        caja["id"]: float(caja.get("saldo_inicial", 0))
+        async for caja in db.cajas.find({}, {"_id": 0, "id": 1, "saldo_inicial": 1})
+    }
+
+    balances = {}
+    async for row in db.cash_operations.aggregate([{"$group": {"_id": "$caja_id", **_SUM_DELTAS}}]):
+        balances[_balance_key(row["_id"])] = {
+            "caja_id": row["_id"],
+            "saldo": initial.get(row["_id"], 0.0) + float(row["movimientos"]),
+            "ultima_actualizacion": row["ultima_actualizacion"],
+        }
+
+    # Cajas sin operaciones parten de su saldo inicial
+    for caja_id, saldo_inicial in initial.items():
+        if caja_id not in balances:
+            balances[caja_id] = {
+                "caja_id": caja_id,
+                "saldo": saldo_inicial,
+                "ultima_actualizacion": None,
+            }
+
+    if balances:
+        await db.caja_balances.bulk_write(
+            [ReplaceOne({"_id": key}, doc, upsert=True) for key, doc in balances.items()],
+            ordered=False,
+        )
+    await db.caja_balances.delete_many({"_id": {"$nin": list(balances.keys())}})
+    return len(balances)
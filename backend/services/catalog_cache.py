@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Iterable, Optional
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from pymongo import ASCENDING
+
+from database import db
+from models.schemas import Product
+from services.conditional import etag_matches
+
+# Red de seguridad si no hay change stream (servidor standalone): cada worker
+# vuelve a leer el catalogo a lo sumo cada CATALOG_CACHE_TTL_SECONDS.
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))
+_WATCH_RETRY_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+
+class _CatalogEntry:
+    __slots__ = ("body", "etag", "loaded_at")
+
+    def __init__(self, body: bytes, etag: str, loaded_at: float):
+        self.body = body
+        self.etag = etag
+        self.loaded_at = loaded_at
+
+
+class CatalogCache:
+    """Catalogo de productos ya serializado, por caja_id (None = todas las cajas)."""
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._entries: dict[Optional[int], _CatalogEntry] = {}
+        # Se incrementan al invalidar; una carga en curso de una caja invalidada no se guarda
+        self._generation = 0
+        self._caja_generations: dict[Optional[int], int] = {}
+        # producto id -> caja_id segun la ultima carga, para invalidar solo su caja
+        self._product_cajas: dict[int, Optional[int]] = {}
+        self._lock = asyncio.Lock()
+
+    def invalidate(self) -> None:
+        # Un producto puede cambiar de caja: se descartan todas las entradas
+        self._generation += 1
+        self._entries.clear()
+
+    def invalidate_products(self, product_ids: Iterable[int]) -> None:
+        """Descarta solo las entradas que contienen esos productos (su caja y la de todas las cajas).
+
+        Para cambios que no mueven productos de caja, como el stock descontado en una venta.
+        """
+        cajas = {self._product_cajas[product_id] for product_id in product_ids if product_id in self._product_cajas}
+        if not cajas:
+            # Ninguna entrada cargada los contiene
+            return
+        cajas.add(None)
+        for caja_id in cajas:
+            self._caja_generations[caja_id] = self._caja_generations.get(caja_id, 0) + 1
+            self._entries.pop(caja_id, None)
+
+    def _generation_of(self, caja_id: Optional[int]) -> tuple[int, int]:
+        return self._generation, self._caja_generations.get(caja_id, 0)
+
+    def _fresh(self, caja_id: Optional[int]) -> Optional[_CatalogEntry]:
+        entry = self._entries.get(caja_id)
+        if entry and time.monotonic() - entry.loaded_at < self._ttl:
+            return entry
+        return None
+
+    async def _load(self, caja_id: Optional[int]) -> _CatalogEntry:
+        query = {}
+        if caja_id is not None:
+            query["caja_id"] = caja_id
+        products = await db.products.find(query, {"_id": 0}).sort("name", ASCENDING).to_list(length=None)
+        for product in products:
+            self._product_cajas[product["id"]] = product.get("caja_id")
+        payload = jsonable_encoder([Product.model_validate(product) for product in products])
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        return _CatalogEntry(body, etag, time.monotonic())
+
+    async def get(self, caja_id: Optional[int]) -> _CatalogEntry:
+        entry = self._fresh(caja_id)
+        if entry:
+            return entry
+
+        async with self._lock:
+            # Otra peticion pudo cargarlo mientras esperabamos el lock
+            entry = self._fresh(caja_id)
+            if entry:
+                return entry
+            generation = self._generation_of(caja_id)
+            entry = await self._load(caja_id)
+            # Si hubo una invalidacion durante la lectura, no guardar datos viejos
+            if generation == self._generation_of(caja_id):
+                self._entries[caja_id] = entry
+            return entry
+
+
+catalog_cache = CatalogCache(CATALOG_CACHE_TTL_SECONDS)
+
+
+async def catalog_response(request: Request, caja_id: Optional[int]) -> Response:
+    """Respuesta JSON del catalogo con ETag; 304 si el cliente ya tiene esa version."""
+    entry = await catalog_cache.get(caja_id)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def _is_unsupported(error: Exception) -> bool:
+    # 40573: "The $changeStream stage is only supported on replica sets"
+    return isinstance(error, NotImplementedError) or getattr(error, "code", None) == 40573
+
+
+def _only_stock_changed(change: dict) -> bool:
+    description = change.get("updateDescription")
+    if change.get("operationType") != "update" or not description:
+        return False
+    if description.get("removedFields") or description.get("truncatedArrays"):
+        return False
+    return set(description.get("updatedFields", {})) <= {"stock"}
+
+
+async def watch_catalog_changes() -> None:
+    """Invalida el cache cuando otro worker modifica products (requiere replica set).
+
+    Los cambios que solo tocan stock (cada venta) se ignoran: el worker que vende invalida
+    su propia caja y en los demas el stock se actualiza con el TTL del cache.
+    """
+    while True:
+        try:
+            async with db.products.watch() as stream:
+                # Lo ocurrido antes de abrir el stream no se vio: descartar lo cargado
+                catalog_cache.invalidate()
+                async for change in stream:
+                    if not _only_stock_changed(change):
+                        catalog_cache.invalidate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Change stream de products no disponible, se usa TTL de %ss: %s", CATALOG_CACHE_TTL_SECONDS, e)
+            if _is_unsupported(e):
+                return
+            await asyncio.sleep(_WATCH_RETRY_SECONDS)
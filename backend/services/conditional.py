@@ -0,0 +1,10 @@
+from fastapi import Request
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True si If-None-Match incluye el ETag (o "*"); la comparacion es debil, como pide RFC 9110."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
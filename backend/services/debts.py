@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClientSession
+from pymongo import ReturnDocument
+
+from database import db
+from services.search import normalize_name
+
+
+def debtor_filter(nombre: str, grupo: str, caja_id: Optional[int]) -> dict:
+    """Clave del deudor; coincide con el indice unico (nombre, grupo, caja_id)."""
+    return {"nombre": nombre, "grupo": grupo, "caja_id": caja_id}
+
+
+async def add_debt(
+    nombre: str,
+    grupo: str,
+    caja_id: Optional[int],
+    monto: float,
+    fecha: datetime,
+    debtor_id: int,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> dict:
+    """Suma monto a la deuda del cliente o lo da de alta, en un solo round trip.
+
+    debtor_id solo se usa si el deudor no existia; si ya existia ese ID queda sin usar.
+    """
+    return await db.debtors.find_one_and_update(
+        debtor_filter(nombre, grupo, caja_id),
+        {
+            "$inc": {"deuda": monto},
+            "$set": {"ultima_compra": fecha},
+            "$setOnInsert": {"id": debtor_id, "fecha_primera_deuda": fecha, "nombre_norm": normalize_name(nombre)},
+        },
+        projection={"_id": 0, "nombre_norm": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator
+
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorCursor
+
+EXPORT_BATCH_SIZE = 500
+
+_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def _ndjson_lines(cursor: AsyncIOMotorCursor) -> AsyncIterator[str]:
+    async for doc in cursor:
+        yield json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n"
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=_json_default, ensure_ascii=False)
+    return value
+
+
+async def _csv_lines(cursor: AsyncIOMotorCursor, columns: list[str]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return line
+
+    writer.writerow(columns)
+    yield flush()
+    async for doc in cursor:
+        writer.writerow([_csv_value(doc.get(column)) for column in columns])
+        yield flush()
+
+
+def stream_export(cursor: AsyncIOMotorCursor, formato: str, columns: list[str], filename: str) -> StreamingResponse:
+    """Envia el cursor como NDJSON o CSV documento a documento, sin cargarlo en memoria."""
+    cursor = cursor.batch_size(EXPORT_BATCH_SIZE)
+    if formato == "csv":
+        body = _csv_lines(cursor, columns)
+    else:
+        body = _ndjson_lines(cursor)
+
+    return StreamingResponse(
+        body,
+        media_type=_MEDIA_TYPES[formato],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{formato}"'},
+    )
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from tempfile import SpooledTemporaryFile
+
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from database import db
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+REPLAYED_HEADER = "Idempotency-Replayed"
+# Una clave "en_curso" mas vieja que esto se considera de un proceso caido
+_IN_PROGRESS_TIMEOUT = timedelta(seconds=60)
+_MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+_MAX_KEY_LENGTH = 255
+# El cuerpo se guarda para compararlo y repetirlo al endpoint; los mayores se rechazan con 413
+IDEMPOTENCY_MAX_BODY_BYTES = int(float(os.getenv("IDEMPOTENCY_MAX_BODY_MB", "25")) * 1024 * 1024)
+# Hasta este tamano el cuerpo queda en memoria; los mayores pasan a un archivo temporal
+_SPOOL_MEMORY_BYTES = 1024 * 1024
+_REPLAY_CHUNK_BYTES = 64 * 1024
+_TOO_LARGE = "Cuerpo demasiado grande para una petición con Idempotency-Key"
+
+
+def _json_response(status: int, detail: str) -> tuple[int, list, bytes]:
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    return status, headers, body
+
+
+async def _send_response(send: Send, status: int, headers: list, body: bytes) -> None:
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """Guarda la respuesta de las peticiones con Idempotency-Key y la repite en los reintentos.
+
+    Las respuestas viven en idempotency_keys hasta que las borra el indice TTL
+    (IDEMPOTENCY_TTL_HOURS). El cuerpo se pasa por un archivo temporal y no puede superar
+    IDEMPOTENCY_MAX_BODY_MB. La primera peticion deja la clave "en_curso"; al terminar
+    (status < 500) se guarda status, headers y body. Un reintento con el mismo cuerpo recibe esa respuesta sin
+    ejecutar el endpoint; con otro cuerpo recibe 422 y, si la original sigue en curso, 409.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in _MUTATING_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        raw_key = headers.get(IDEMPOTENCY_HEADER.encode())
+        if not raw_key:
+            await self.app(scope, receive, send)
+            return
+
+        key = raw_key.decode("latin-1").strip()
+        if not key or len(key) > _MAX_KEY_LENGTH:
+            await _send_response(send, *_json_response(400, "Idempotency-Key inválida"))
+            return
+
+        declared = headers.get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > IDEMPOTENCY_MAX_BODY_BYTES:
+            await _send_response(send, *_json_response(413, _TOO_LARGE))
+            return
+
+        spool = SpooledTemporaryFile(max_size=_SPOOL_MEMORY_BYTES)
+        try:
+            await self._handle(scope, receive, send, key, spool)
+        finally:
+            spool.close()
+
+    async def _handle(self, scope: Scope, receive: Receive, send: Send, key: str, spool: SpooledTemporaryFile) -> None:
+        # Leer el cuerpo calculando su hash; se guarda en el spool para pasarlo al endpoint
+        # La query string cuenta como parte de la peticion (p. ej. ?monto= en pagos)
+        digest = hashlib.sha256(scope.get("query_string", b"") + b"\0")
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > IDEMPOTENCY_MAX_BODY_BYTES:
+                await _send_response(send, *_json_response(413, _TOO_LARGE))
+                return
+            digest.update(chunk)
+            if size <= _SPOOL_MEMORY_BYTES:
+                spool.write(chunk)
+            else:
+                await run_in_threadpool(spool.write, chunk)
+            more_body = message.get("more_body", False)
+        request_hash = digest.hexdigest()
+
+        scope_key = f"{scope['method']} {scope['path']} {key}"
+        record_id = hashlib.sha256(scope_key.encode("utf-8")).hexdigest()
+
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": record_id,
+                "status": "en_curso",
+                "request_hash": request_hash,
+                "created_at": datetime.utcnow(),
+            })
+        except DuplicateKeyError:
+            await self._replay(record_id, request_hash, send)
+            return
+
+        spool.seek(0)
+        in_memory = size <= _SPOOL_MEMORY_BYTES
+        remaining = size
+        body_sent = False
+
+        async def replay_receive() -> Message:
+            nonlocal remaining, body_sent
+            if not body_sent:
+                if in_memory:
+                    chunk = spool.read()
+                else:
+                    chunk = await run_in_threadpool(spool.read, _REPLAY_CHUNK_BYTES)
+                remaining -= len(chunk)
+                body_sent = remaining <= 0
+                return {"type": "http.request", "body": chunk, "more_body": not body_sent}
+            return await receive()
+
+        response = {"status": 500, "headers": [], "body": []}
+
+        async def capture_send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await db.idempotency_keys.delete_one({"_id": record_id})
+            raise
+
+        if response["status"] >= 500:
+            # Los errores del servidor no se guardan: el reintento vuelve a ejecutar
+            await db.idempotency_keys.delete_one({"_id": record_id})
+            return
+
+        await db.idempotency_keys.update_one(
+            {"_id": record_id},
+            {"$set": {
+                "status": "completa",
+                "response_status": response["status"],
+                "response_headers": [[name, value] for name, value in response["headers"]],
+                "response_body": b"".join(response["body"]),
+            }},
+        )
+
+    async def _replay(self, record_id: str, request_hash: str, send: Send) -> None:
+        record = await db.idempotency_keys.find_one({"_id": record_id})
+        if record is None:
+            # Expiro o fallo entre el insert y la lectura: pedir que se reintente
+            await _send_response(send, *_json_response(409, "Reintenta la petición"))
+            return
+        if record["request_hash"] != request_hash:
+            await _send_response(send, *_json_response(422, "La Idempotency-Key ya se usó con otro cuerpo"))
+            return
+        if record["status"] != "completa":
+            if datetime.utcnow() - record["created_at"] > _IN_PROGRESS_TIMEOUT:
+                await db.idempotency_keys.delete_one({"_id": record_id, "status": "en_curso"})
+            await _send_response(send, *_json_response(409, "La petición original todavía está en proceso"))
+            return
+
+        headers = [(bytes(name), bytes(value)) for name, value in record["response_headers"]]
+        headers.append((REPLAYED_HEADER.lower().encode(), b"true"))
+        await _send_response(send, record["response_status"], headers, bytes(record["response_body"]))
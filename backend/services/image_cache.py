@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
+
+from services.conditional import etag_matches
+from services.storage import get_local_product_image_path, open_s3_product_image
+
+# Cache en disco de imagenes de S3, direccionado por contenido:
+#   blobs/<sha256 del contenido>   bytes de la imagen
+#   keys/<sha256 de la URL>.json   {"sha256": ..., "content_type": ...}
+IMAGE_CACHE_DIR = Path(
+    os.getenv("IMAGE_CACHE_DIR", str(Path(__file__).resolve().parents[1] / "cache" / "images"))
+)
+IMAGE_CACHE_MAX_BYTES = int(float(os.getenv("IMAGE_CACHE_MAX_MB", "256")) * 1024 * 1024)
+IMAGE_CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "public, max-age=300")
+_CHUNK_SIZE = 64 * 1024
+
+
+class CachedImage:
+    __slots__ = ("path", "etag", "content_type")
+
+    def __init__(self, path: Path, etag: str, content_type: Optional[str]):
+        self.path = path
+        self.etag = etag
+        self.content_type = content_type
+
+
+def _url_key(image_url: str) -> str:
+    return hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+
+
+def _etag(sha256: str) -> str:
+    return f'"{sha256}"'
+
+
+class ImageDiskCache:
+    """Cache LRU en disco; la fecha de modificacion de cada blob marca su ultimo uso."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self._blobs = root / "blobs"
+        self._keys = root / "keys"
+        self._max_bytes = max_bytes
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def _lookup(self, key: str) -> Optional[CachedImage]:
+        try:
+            meta = json.loads((self._keys / f"{key}.json").read_text())
+            path = self._blobs / meta["sha256"]
+            os.utime(path)  # marcar como usado recientemente
+        except (OSError, ValueError, KeyError):
+            return None
+        return CachedImage(path, _etag(meta["sha256"]), meta.get("content_type"))
+
+    def _download(self, image_url: str, key: str) -> CachedImage:
+        self._blobs.mkdir(parents=True, exist_ok=True)
+        self._keys.mkdir(parents=True, exist_ok=True)
+
+        body, content_type = open_s3_product_image(image_url)
+        digest = hashlib.sha256()
+        fd, tmp_name = tempfile.mkstemp(dir=self._blobs, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                for chunk in body.iter_chunks(_CHUNK_SIZE):
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+            sha256 = digest.hexdigest()
+            path = self._blobs / sha256
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        finally:
+            body.close()
+
+        meta = json.dumps({"sha256": sha256, "content_type": content_type})
+        (self._keys / f"{key}.json").write_text(meta)
+        self._evict()
+        return CachedImage(path, _etag(sha256), content_type)
+
+    def _evict(self) -> None:
+        blobs = []
+        total = 0
+        for path in self._blobs.iterdir():
+            if path.suffix == ".tmp":
+                continue
+            stat = path.stat()
+            blobs.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        # Las claves que apunten a un blob borrado se tratan como fallo de cache
+        for _, size, path in sorted(blobs):
+            if total <= self._max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    async def get(self, image_url: str) -> CachedImage:
+        """Imagen de S3 desde el cache; la descarga en streaming si no esta."""
+        key = _url_key(image_url)
+        cached = await run_in_threadpool(self._lookup, key)
+        if cached:
+            return cached
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                # Otra peticion pudo descargarla mientras esperabamos
+                cached = await run_in_threadpool(self._lookup, key)
+                if cached:
+                    return cached
+                return await run_in_threadpool(self._download, image_url, key)
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
+
+
+image_cache = ImageDiskCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+
+# sha256 de archivos locales por (ruta, mtime, tamano) para no releerlos en cada GET
+_local_etags: dict[tuple[str, int, int], str] = {}
+
+
+def _local_image(path: Path) -> CachedImage:
+    stat = path.stat()
+    memo_key = (str(path), stat.st_mtime_ns, stat.st_size)
+    etag = _local_etags.get(memo_key)
+    if etag is None:
+        digest = hashlib.sha256()
+        with path.open("rb") as image_file:
+            for chunk in iter(lambda: image_file.read(_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        etag = _etag(digest.hexdigest())
+        _local_etags[memo_key] = etag
+    return CachedImage(path, etag, None)
+
+
+async def local_product_image(image_url: str) -> Optional[CachedImage]:
+    path = get_local_product_image_path(image_url)
+    if not path.exists():
+        return None
+    return await run_in_threadpool(_local_image, path)
+
+
+def image_response(request: Request, image: CachedImage) -> Response:
+    """FileResponse con ETag fuerte y Cache-Control; 304 si el cliente ya la tiene."""
+    headers = {"ETag": image.etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if etag_matches(request, image.etag):
+        return Response(status_code=304, headers=headers)
+    # FileResponse envia el archivo por bloques y atiende Range
+    return FileResponse(path=image.path, media_type=image.content_type, headers=headers)
@@ -0,0 +1,95 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+# Tamano maximo (ancho, alto) de cada derivado; se conserva la proporcion.
+VARIANT_SIZES: dict[str, tuple[int, int]] = {
+    "thumb": (160, 160),
+    "card": (480, 480),
+    "full": (1280, 1280),
+}
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+if features.check("webp"):
+    VARIANT_FORMAT, VARIANT_EXTENSION, VARIANT_CONTENT_TYPE = "WEBP", "webp", "image/webp"
+else:
+    VARIANT_FORMAT, VARIANT_EXTENSION, VARIANT_CONTENT_TYPE = "JPEG", "jpg", "image/jpeg"
+
+_executor: Optional[ProcessPoolExecutor] = None
+logger = logging.getLogger(__name__)
+
+
+def _normalize_mode(image: Image.Image) -> Image.Image:
+    """RGB/RGBA para WebP; en JPEG las transparencias van sobre fondo blanco."""
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if not has_alpha:
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+    image = image if image.mode == "RGBA" else image.convert("RGBA")
+    if VARIANT_FORMAT == "WEBP":
+        return image
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    background.paste(image, mask=image.split()[-1])
+    return background
+
+
+def spool_to_disk(fileobj: BinaryIO) -> str:
+    """Copia la imagen subida por bloques a un archivo temporal y devuelve su ruta.
+
+    El worker la lee de ahi: ni la peticion ni el pool pasan la imagen completa en memoria.
+    Quien la recibe la borra con os.remove al terminar.
+    """
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="variant_", delete=False) as target:
+        shutil.copyfileobj(fileobj, target, length=1024 * 1024)
+        return target.name
+
+
+def render_variants(source_path: str) -> dict[str, bytes]:
+    """Genera los derivados de VARIANT_SIZES. Corre en un proceso del pool."""
+    with Image.open(source_path) as source:
+        source = ImageOps.exif_transpose(source)
+        source = _normalize_mode(source)
+
+        variants = {}
+        for size_name, max_size in VARIANT_SIZES.items():
+            image = source.copy()
+            image.thumbnail(max_size, Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY, optimize=True)
+            variants[size_name] = output.getvalue()
+        return variants
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn y no fork: el proceso ya tiene hilos (Motor, logging) cuyos locks heredaria un fork
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def build_variants(source_path: str) -> dict[str, bytes]:
+    """Derivados de la imagen en source_path sin bloquear el event loop; {} si Pillow no puede leerla."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_executor(), render_variants, source_path)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning("No se pudieron generar derivados de la imagen: %s", e)
+        return {}
+
+
+def shutdown_variant_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
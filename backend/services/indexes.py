@@ -0,0 +1,248 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Indices compuestos disenados para las consultas de cada router:
+# igualdad primero, luego el orden/rango (fecha, id) que usan los listados.
+INDEXES: dict[str, list[IndexModel]] = {
+    "cajas": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("nombre", ASCENDING)], unique=True),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("name", ASCENDING)]),
+        # Unico: clave del upsert de la carga masiva (merge_duplicate_products.py limpia datos previos)
+        IndexModel([("caja_id", ASCENDING), ("name", ASCENDING)], unique=True),
+    ],
+    "transactions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("fecha", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("caja_id", ASCENDING), ("fecha", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("cliente", ASCENDING), ("fecha", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("cliente_norm", ASCENDING), ("fecha", DESCENDING), ("id", DESCENDING)]),
+        # Lotes de terminales offline: una venta por clave aunque el lote se reenvie
+        IndexModel(
+            [("idempotency_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$type": "string"}},
+        ),
+    ],
+    "debtors": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("deuda", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("grupo", ASCENDING), ("deuda", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("nombre_norm", ASCENDING), ("deuda", DESCENDING), ("id", DESCENDING)]),
+        # Un deudor por cliente y caja: permite el upsert atomico de las ventas a credito
+        IndexModel([("nombre", ASCENDING), ("grupo", ASCENDING), ("caja_id", ASCENDING)], unique=True),
+    ],
+    "cash_operations": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("fecha", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("caja_id", ASCENDING), ("fecha", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "idempotency_keys": [
+        IndexModel(
+            [("created_at", ASCENDING)],
+            expireAfterSeconds=int(float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")) * 3600),
+        ),
+    ],
+    "daily_rollups": [
+        IndexModel([("fecha", ASCENDING), ("caja_id", ASCENDING)]),
+        IndexModel([("caja_id", ASCENDING), ("fecha", ASCENDING)]),
+    ],
+}
+
+# Indices de un solo campo que quedaron cubiertos por los compuestos.
+OBSOLETE_INDEXES: dict[str, list[str]] = {
+    "transactions": ["fecha_1"],
+    "debtors": ["deuda_1", "grupo_1_deuda_-1", "nombre_norm_1"],
+    "cash_operations": ["fecha_1"],
+}
+
+# auto: crear solo si cambiaron las definiciones | always: crear siempre | skip: no tocar
+MONGODB_INDEX_MODE = os.getenv("MONGODB_INDEX_MODE", "auto").strip().lower()
+
+_INDEX_CONFLICT_CODES = {85, 86}  # IndexOptionsConflict, IndexKeySpecsConflict
+_DUPLICATE_KEY = 11000
+
+_SAMPLE_DATE = datetime(2025, 1, 1)
+_SAMPLE_RANGE = {"$gte": _SAMPLE_DATE, "$lte": datetime(2025, 1, 31, 23, 59, 59)}
+_BY_FECHA = [("fecha", DESCENDING), ("id", DESCENDING)]
+_BY_DEUDA = [("deuda", DESCENDING), ("id", DESCENDING)]
+_BY_CLIENTE_NORM = [("cliente_norm", ASCENDING), ("fecha", DESCENDING), ("id", DESCENDING)]
+_BY_NOMBRE_NORM = [("nombre_norm", ASCENDING), ("deuda", DESCENDING), ("id", DESCENDING)]
+_PREFIX = {"$regex": "^cliente"}
+
+# Forma de cada consulta de los routers: (nombre, coleccion, filtro, orden).
+QUERY_SHAPES: list[tuple[str, str, dict, Optional[list]]] = [
+    ("cajas.get_cajas", "cajas", {}, [("nombre", ASCENDING)]),
+    ("products.get_all_products", "products", {}, [("name", ASCENDING)]),
+    ("products.get_all_products?caja_id", "products", {"caja_id": 1}, [("name", ASCENDING)]),
+    ("transactions.get_transactions", "transactions", {}, _BY_FECHA),
+    ("transactions.get_transactions?caja_id", "transactions", {"caja_id": 1, "fecha": _SAMPLE_RANGE}, _BY_FECHA),
+    ("transactions.get_transactions_by_teacher", "transactions", {"cliente": "Cliente", "fecha": _SAMPLE_RANGE}, _BY_FECHA),
+    ("transactions.get_teacher_summary", "transactions", {"cliente": "Cliente"}, _BY_FECHA),
+    ("transactions.get_transactions?cursor", "transactions", {"$or": [{"fecha": {"$lt": _SAMPLE_DATE}}, {"fecha": _SAMPLE_DATE, "id": {"$lt": 5}}]}, _BY_FECHA),
+    ("transactions.get_transactions?cliente", "transactions", {"cliente_norm": _PREFIX}, _BY_CLIENTE_NORM),
+    ("transactions.get_transactions?cliente&cursor", "transactions", {"$and": [
+        {"cliente_norm": _PREFIX},
+        {"$or": [{"cliente_norm": {"$gt": "cliente"}}, {"cliente_norm": "cliente", "fecha": {"$lt": _SAMPLE_DATE}}]},
+    ]}, _BY_CLIENTE_NORM),
+    ("debtors.get_all_debtors", "debtors", {}, _BY_DEUDA),
+    ("debtors.get_all_debtors?nombre", "debtors", {"nombre_norm": _PREFIX}, _BY_NOMBRE_NORM),
+    ("debtors.get_all_debtors?grupo", "debtors", {"grupo": "General"}, _BY_DEUDA),
+    ("debtors.get_all_debtors?cursor", "debtors", {"$or": [{"deuda": {"$lt": 10}}, {"deuda": 10, "id": {"$lt": 5}}]}, _BY_DEUDA),
+    ("debtors.get_debtor_by_name", "debtors", {"nombre": "Cliente", "grupo": "General"}, None),
+    ("transactions.create_transaction.debtor", "debtors", {"nombre": "Cliente", "grupo": "General", "caja_id": 1}, None),
+    ("cash.get_cash_operations", "cash_operations", {}, _BY_FECHA),
+    ("cash.get_cash_operations?caja_id", "cash_operations", {"caja_id": 1, "fecha": _SAMPLE_RANGE}, _BY_FECHA),
+    ("cash_ledger.ledger_balance", "cash_operations", {"caja_id": 1}, None),
+    ("rollups.find_rollups", "daily_rollups", {"fecha": {"$gte": "2025-01-01"}}, [("fecha", ASCENDING), ("caja_id", ASCENDING)]),
+    ("rollups.find_rollups?caja_id", "daily_rollups", {"fecha": {"$gte": "2025-01-01"}, "caja_id": 1}, [("fecha", ASCENDING), ("caja_id", ASCENDING)]),
+]
+
+
+def _non_unique(model: IndexModel) -> IndexModel:
+    options = {name: value for name, value in model.document.items() if name not in ("key", "unique")}
+    return IndexModel(list(model.document["key"].items()), **options)
+
+
+def _has_duplicates(collection: Collection, keys: dict) -> bool:
+    group_id = {field.replace(".", "_"): f"${field}" for field in keys}
+    pipeline = [{"$group": {"_id": group_id, "n": {"$sum": 1}}}, {"$match": {"n": {"$gt": 1}}}, {"$limit": 1}]
+    return bool(list(collection.aggregate(pipeline, allowDiskUse=True)))
+
+
+def _create_index(collection: Collection, model: IndexModel) -> bool:
+    """Crea el indice; False si es unico y la coleccion tiene duplicados.
+
+    En ese caso se conserva el indice que ya existia o, si no habia, se crea el mismo sin
+    unique: las consultas no pasan a recorrer la coleccion mientras se fusionan los duplicados.
+    """
+    try:
+        collection.create_indexes([model])
+        return True
+    except OperationFailure as exc:
+        if exc.code == _DUPLICATE_KEY:
+            collection.create_indexes([_non_unique(model)])
+            return False
+        if exc.code not in _INDEX_CONFLICT_CODES:
+            raise
+
+    # Mismo nombre con otras opciones: recrear con la definicion actual, sin soltar
+    # el existente si el nuevo no se va a poder crear
+    if model.document.get("unique") and _has_duplicates(collection, model.document["key"]):
+        return False
+    collection.drop_index(model.document["name"])
+    try:
+        collection.create_indexes([model])
+        return True
+    except OperationFailure as exc:
+        if exc.code != _DUPLICATE_KEY:
+            raise
+        # Duplicados insertados entre la verificacion y la creacion
+        collection.create_indexes([_non_unique(model)])
+        return False
+
+
+def ensure_indexes(database: Database) -> list[str]:
+    """Crea los indices declarados en INDEXES y elimina los obsoletos.
+
+    Devuelve los indices unicos que no se pudieron crear por datos duplicados.
+    """
+    skipped = []
+    for collection_name, models in INDEXES.items():
+        collection = database[collection_name]
+        for model in models:
+            if not _create_index(collection, model):
+                # Datos previos con duplicados: no bloquear el arranque
+                # (se corrigen con merge_duplicate_debtors.py / merge_duplicate_products.py)
+                logger.warning(
+                    "No se pudo crear el indice unico %s en %s: hay documentos duplicados",
+                    model.document["name"], collection_name,
+                )
+                skipped.append(f"{collection_name}.{model.document['name']}")
+
+    for collection_name, index_names in OBSOLETE_INDEXES.items():
+        existing = database[collection_name].index_information()
+        for index_name in index_names:
+            if index_name in existing:
+                database[collection_name].drop_index(index_name)
+    return skipped
+
+
+def index_fingerprint() -> str:
+    """Huella de INDEXES y OBSOLETE_INDEXES: cambia cuando se despliega otra definicion."""
+    spec = {
+        "indexes": {name: [model.document for model in models] for name, models in INDEXES.items()},
+        "obsolete": OBSOLETE_INDEXES,
+    }
+    return hashlib.sha256(json.dumps(spec, default=str).encode("utf-8")).hexdigest()
+
+
+def sync_indexes(database: Database, mode: str = MONGODB_INDEX_MODE) -> str:
+    """Aplica ensure_indexes segun MONGODB_INDEX_MODE; devuelve "creados" u "omitidos".
+
+    En modo auto la huella aplicada se guarda en schema_meta, asi que solo la primera
+    instancia tras un despliegue con indices nuevos los crea; las demas solo leen un documento.
+    """
+    if mode == "skip":
+        return "omitidos"
+
+    fingerprint = index_fingerprint()
+    if mode == "auto":
+        applied = database.schema_meta.find_one({"_id": "indexes"}, {"fingerprint": 1})
+        if applied and applied.get("fingerprint") == fingerprint:
+            return "omitidos"
+
+    if ensure_indexes(database):
+        # Falta algun indice unico: volver a intentarlo en el siguiente arranque
+        return "creados"
+    database.schema_meta.update_one(
+        {"_id": "indexes"},
+        {"$set": {"fingerprint": fingerprint, "updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    return "creados"
+
+
+def _plan_stages(plan: dict[str, Any]) -> list[str]:
+    stages = [plan.get("stage", "")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+def check_query_plans(database: Database) -> list[str]:
+    """Ejecuta explain() sobre cada consulta de QUERY_SHAPES.
+
+    Devuelve la lista de consultas que hacen COLLSCAN u ordenan en memoria.
+    """
+    problems = []
+    for name, collection_name, query, sort in QUERY_SHAPES:
+        cursor = database[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = cursor.explain()
+        winning_plan = explain["queryPlanner"]["winningPlan"]
+        stages = _plan_stages(winning_plan)
+
+        if "COLLSCAN" in stages:
+            problems.append(f"{name}: COLLSCAN en {collection_name}")
+        if "SORT" in stages:
+            problems.append(f"{name}: ordenamiento en memoria en {collection_name}")
+    return problems
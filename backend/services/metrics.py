@@ -0,0 +1,227 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+# Comandos y tiempo en Mongo de la peticion en curso, en total y por coleccion
+# ({coleccion: [comandos, segundos]}); Motor copia el contexto al hilo donde corre
+# pymongo, asi que el listener ve el mismo dict que el middleware
+_request_db: ContextVar[Optional[dict]] = ContextVar("request_db", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple, amount: float = 1) -> None:
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [conteo por bucket (no acumulado) ..., +Inf, suma]
+        self._series: dict[tuple, list[float]] = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self._series.setdefault(labels, [0] * (len(self.buckets) + 2))
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.label_names, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {_format_value(cumulative)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metricas del proceso en memoria, en formato de texto de Prometheus.
+
+    Cada worker tiene sus propios contadores; Prometheus los suma al consultar.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.http_duration = Histogram(
+            "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta.",
+            ("method", "route", "status"), LATENCY_BUCKETS,
+        )
+        self.http_db_commands = Histogram(
+            "http_request_db_commands", "Comandos enviados a MongoDB por peticion HTTP.",
+            ("method", "route"), ROUND_TRIP_BUCKETS,
+        )
+        self.http_db_duration = Histogram(
+            "http_request_db_duration_seconds", "Tiempo esperando a MongoDB por peticion HTTP.",
+            ("method", "route"), LATENCY_BUCKETS,
+        )
+        self.http_collection_commands = Histogram(
+            "http_request_db_collection_commands", "Comandos por coleccion de MongoDB en cada peticion HTTP.",
+            ("method", "route", "collection"), ROUND_TRIP_BUCKETS,
+        )
+        self.http_collection_duration = Histogram(
+            "http_request_db_collection_duration_seconds", "Tiempo por coleccion de MongoDB en cada peticion HTTP.",
+            ("method", "route", "collection"), LATENCY_BUCKETS,
+        )
+        self.db_duration = Histogram(
+            "mongodb_command_duration_seconds", "Duracion de los comandos de MongoDB por coleccion.",
+            ("collection", "command"), DB_LATENCY_BUCKETS,
+        )
+        self.db_failures = Counter(
+            "mongodb_command_failures_total", "Comandos de MongoDB que devolvieron error.",
+            ("collection", "command"),
+        )
+
+    def observe_request(self, method: str, route: str, status: int, duration: float, db_stats: dict) -> None:
+        with self._lock:
+            self.http_duration.observe((method, route, str(status)), duration)
+            self.http_db_commands.observe((method, route), db_stats["commands"])
+            self.http_db_duration.observe((method, route), db_stats["duration"])
+            for collection, (commands, duration) in db_stats["collections"].items():
+                self.http_collection_commands.observe((method, route, collection), commands)
+                self.http_collection_duration.observe((method, route, collection), duration)
+
+    def observe_command(self, collection: str, command: str, duration: float, failed: bool) -> None:
+        with self._lock:
+            self.db_duration.observe((collection, command), duration)
+            if failed:
+                self.db_failures.inc((collection, command))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = (
+                self.http_duration, self.http_db_commands, self.http_db_duration,
+                self.http_collection_commands, self.http_collection_duration, self.db_duration, self.db_failures,
+            )
+            lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Cuenta cada comando de pymongo/Motor por coleccion y, si hay una, en la peticion HTTP en curso."""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._lock = threading.Lock()
+        # (connection_id, request_id) -> coleccion; el evento de fin no trae el comando
+        self._collections: dict[tuple, str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            # getMore lleva el cursor como valor; aggregate: 1 y admin no tienen coleccion
+            target = event.command.get("collection", "-")
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = target
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool) -> None:
+        duration = event.duration_micros / 1_000_000
+        request_db = _request_db.get()
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), "-")
+            # Consultas en paralelo (gather) terminan en hilos distintos
+            if request_db is not None:
+                request_db["commands"] += 1
+                request_db["duration"] += duration
+                per_collection = request_db["collections"].setdefault(collection, [0, 0.0])
+                per_collection[0] += 1
+                per_collection[1] += duration
+        self.registry.observe_command(collection, event.command_name, duration, failed)
+
+
+command_metrics = CommandMetricsListener(metrics_registry)
+
+
+def _route_label(scope: Scope) -> str:
+    """Plantilla de la ruta ("/api/products/{product_id}") para no crear una serie por ID."""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "app_root_path" in scope:
+        # Archivos servidos por un Mount, p. ej. /static
+        return scope["root_path"] + "/{path}"
+    return "sin_ruta"
+
+
+class MetricsMiddleware:
+    """Mide latencia y comandos de MongoDB de cada peticion HTTP."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        db_stats = {"commands": 0, "duration": 0.0, "collections": {}}
+        token = _request_db.set(db_stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_db.reset(token)
+            metrics_registry.observe_request(
+                scope["method"], _route_label(scope), status, time.perf_counter() - started, db_stats,
+            )
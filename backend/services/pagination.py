@@ -0,0 +1,54 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "d" in value:
+        return datetime.fromisoformat(value["d"])
+    return value
+
+
+def encode_cursor(doc: dict, sort: list[tuple[str, int]]) -> str:
+    """Token opaco con los valores de orden del ultimo documento de la pagina."""
+    values = [_encode_value(doc.get(field)) for field, _ in sort]
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, sort: list[tuple[str, int]]) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = [_decode_value(value) for value in json.loads(raw)]
+    except (binascii.Error, ValueError, TypeError) as exc:
+        raise ValueError("Cursor inválido") from exc
+    if len(values) != len(sort):
+        raise ValueError("Cursor inválido")
+    return values
+
+
+def keyset_filter(mongo_filter: dict, sort: list[tuple[str, int]], token: str) -> dict:
+    """Agrega al filtro la condicion "despues del cursor" para el orden dado.
+
+    Para [("fecha", -1), ("id", -1)] genera:
+    fecha < f  OR  (fecha == f AND id < i)
+    """
+    values = decode_cursor(token, sort)
+    branches = []
+    for position, (field, direction) in enumerate(sort):
+        branch = {prev_field: values[i] for i, (prev_field, _) in enumerate(sort[:position])}
+        branch[field] = {"$lt" if direction < 0 else "$gt": values[position]}
+        branches.append(branch)
+
+    if not mongo_filter:
+        return {"$or": branches}
+    return {"$and": [mongo_filter, {"$or": branches}]}
@@ -0,0 +1,129 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Optional
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import db, reserve_sequence
+from models.schemas import ProductCreate
+
+MAX_BULK_PRODUCTS = 10000
+CSV_COLUMNS = ("name", "price", "stock", "image_url", "caja_id")
+
+
+def parse_rows(body: bytes, content_type: str) -> list[dict]:
+    """Filas de la carga: lista JSON (o {"products": [...]}) o CSV con encabezado."""
+    if "csv" in content_type:
+        reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+        unknown = set(reader.fieldnames or []) - set(CSV_COLUMNS)
+        if unknown:
+            raise ValueError(f"Columnas desconocidas en el CSV: {', '.join(sorted(unknown))}")
+        # Las celdas vacias cuentan como campo no enviado
+        return [{key: value for key, value in row.items() if value not in (None, "")} for row in reader]
+
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get("products")
+    if not isinstance(payload, list) or not all(isinstance(row, dict) for row in payload):
+        raise ValueError("Se esperaba una lista de productos")
+    return payload
+
+
+def _validation_detail(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()
+    )
+
+
+async def import_products(rows: list[dict], caja_id: Optional[int] = None) -> dict:
+    """Valida y hace upsert de los productos por (caja_id, name) con un solo bulk_write."""
+    report: list[dict] = [{"fila": index + 1} for index in range(len(rows))]
+    valid: dict[tuple, int] = {}  # (caja_id, name) -> indice de la fila
+    products: dict[int, ProductCreate] = {}
+
+    for index, row in enumerate(rows):
+        if caja_id is not None and row.get("caja_id") in (None, ""):
+            row = {**row, "caja_id": caja_id}
+        try:
+            product = ProductCreate.model_validate(row)
+        except ValidationError as e:
+            report[index].update(status="error", detail=_validation_detail(e))
+            continue
+
+        key = (product.caja_id, product.name)
+        report[index].update(name=product.name, caja_id=product.caja_id)
+        if key in valid:
+            report[index].update(status="error", detail=f"Producto repetido en la carga (fila {valid[key] + 1})")
+            continue
+        valid[key] = index
+        products[index] = product
+
+    # IDs de los productos que ya existen, para reservar solo los nuevos
+    existing_ids: dict[tuple, int] = {}
+    names = list({name for _, name in valid})
+    if names:
+        cursor = db.products.find({"name": {"$in": names}}, {"_id": 0, "id": 1, "name": 1, "caja_id": 1})
+        async for doc in cursor:
+            key = (doc.get("caja_id"), doc["name"])
+            if key in valid:
+                existing_ids.setdefault(key, doc["id"])
+
+    new_keys = [key for key in valid if key not in existing_ids]
+    new_ids = iter(await reserve_sequence("products", len(new_keys))) if new_keys else iter(())
+    now = datetime.utcnow()
+
+    operations = []
+    op_rows = []
+    for key, index in valid.items():
+        product = products[index]
+        set_fields = product.model_dump(exclude_unset=True)
+        set_fields.update(name=product.name, caja_id=product.caja_id)
+        on_insert = {
+            field: value
+            for field, value in product.model_dump().items()
+            if field not in set_fields
+        }
+        product_id = existing_ids.get(key) or next(new_ids)
+        on_insert.update(id=product_id, created_at=now)
+
+        operations.append(UpdateOne(
+            {"caja_id": product.caja_id, "name": product.name},
+            {"$set": set_fields, "$setOnInsert": on_insert},
+            upsert=True,
+        ))
+        op_rows.append(index)
+        report[index].update(
+            status="actualizado" if key in existing_ids else "creado",
+            id=product_id,
+        )
+
+    if operations:
+        try:
+            result = await db.products.bulk_write(operations, ordered=False)
+            upserted = set(result.upserted_ids)
+        except BulkWriteError as e:
+            upserted = {item["index"] for item in e.details.get("upserted", [])}
+            for write_error in e.details.get("writeErrors", []):
+                index = op_rows[write_error["index"]]
+                report[index].update(status="error", detail=write_error.get("errmsg", "Error de escritura"))
+                report[index].pop("id", None)
+
+        # Otro proceso pudo crear el producto entre la busqueda y el bulk_write: por el
+        # indice unico (caja_id, name) el upsert termina actualizando ese documento
+        raced = [
+            index for op_index, index in enumerate(op_rows)
+            if report[index]["status"] == "creado" and op_index not in upserted
+        ]
+        for index in raced:
+            product = products[index]
+            doc = await db.products.find_one({"caja_id": product.caja_id, "name": product.name}, {"_id": 0, "id": 1})
+            report[index].update(status="actualizado", id=doc["id"] if doc else None)
+
+    summary = {status: 0 for status in ("creado", "actualizado", "error")}
+    for row in report:
+        summary[row["status"]] += 1
+    return {"total": len(rows), **summary, "filas": report}
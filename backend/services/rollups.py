@@ -0,0 +1,225 @@
+import hashlib
+from datetime import datetime
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorDatabase
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+from database import db
+
+SALES_FIELDS = ("total_transacciones", "total_ventas", "total_efectivo", "total_credito")
+CASH_FIELDS = ("ingresos", "egresos", "ajustes")
+
+
+def rollup_day(fecha: datetime) -> str:
+    return fecha.strftime("%Y-%m-%d")
+
+
+def _rollup_id(day: str, caja_id: Optional[int]) -> str:
+    return f"{day}|{caja_id if caja_id is not None else 'general'}"
+
+
+def _product_key(nombre: str) -> str:
+    # Los nombres pueden tener "." o "$", que no sirven como ruta de campo
+    return hashlib.md5(nombre.encode("utf-8")).hexdigest()[:16]
+
+
+def _empty_rollup(day: str, caja_id: Optional[int]) -> dict:
+    doc = {"fecha": day, "caja_id": caja_id, "productos": {}}
+    for field in SALES_FIELDS + CASH_FIELDS:
+        doc[field] = 0
+    return doc
+
+
+async def _apply(
+    day: str,
+    caja_id: Optional[int],
+    inc: dict,
+    set_fields: dict,
+    session: Optional[AsyncIOMotorClientSession],
+) -> None:
+    update = {"$inc": inc, "$setOnInsert": {"fecha": day, "caja_id": caja_id}}
+    if set_fields:
+        update["$set"] = set_fields
+    await db.daily_rollups.update_one(
+        {"_id": _rollup_id(day, caja_id)},
+        update,
+        upsert=True,
+        session=session,
+    )
+
+
+def _sale_increments(transaction: dict) -> tuple[dict, dict]:
+    total = float(transaction["total"])
+    pago = float(transaction["pago"])
+    inc = {
+        "total_transacciones": 1,
+        "total_ventas": total,
+        "total_efectivo": pago,
+        "total_credito": total - pago if transaction["pagado"] == "NO" else 0,
+    }
+    set_fields = {}
+    for producto in transaction["productos"]:
+        key = _product_key(producto["nombre"])
+        inc[f"productos.{key}.unidades"] = inc.get(f"productos.{key}.unidades", 0) + producto["cantidad"]
+        set_fields[f"productos.{key}.nombre"] = producto["nombre"]
+    return inc, set_fields
+
+
+async def record_sale(
+    transaction: dict,
+    cash_operation: Optional[dict] = None,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> None:
+    """Suma una venta, y su operacion de caja si la hubo, al rollup de su dia y caja con un solo update."""
+    inc, set_fields = _sale_increments(transaction)
+    if cash_operation is not None:
+        for field, value in _cash_increments(cash_operation["tipo_operacion"], float(cash_operation["monto"])).items():
+            inc[field] = inc.get(field, 0) + value
+    await _apply(rollup_day(transaction["fecha"]), transaction.get("caja_id"), inc, set_fields, session)
+
+
+def _cash_increments(tipo_operacion: str, monto: float) -> dict:
+    if tipo_operacion in ["INGRESO", "VENTA"]:
+        return {"ingresos": abs(monto)}
+    if tipo_operacion == "EGRESO":
+        return {"egresos": abs(monto)}
+    return {"ajustes": monto}
+
+
+async def record_cash(operation: dict, session: Optional[AsyncIOMotorClientSession] = None) -> None:
+    """Suma una operacion de caja al rollup de su dia y caja."""
+    inc = _cash_increments(operation["tipo_operacion"], float(operation["monto"]))
+    await _apply(rollup_day(operation["fecha"]), operation.get("caja_id"), inc, {}, session)
+
+
+async def record_batch(
+    transactions: list[dict],
+    operations: list[dict],
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> None:
+    """Suma un lote de ventas y operaciones de caja con un update por rollup (dia, caja)."""
+    updates: dict[str, dict] = {}
+
+    def merge(fecha: datetime, caja_id: Optional[int], inc: dict, set_fields: dict) -> None:
+        day = rollup_day(fecha)
+        entry = updates.setdefault(_rollup_id(day, caja_id), {"day": day, "caja_id": caja_id, "inc": {}, "set": {}})
+        for field, value in inc.items():
+            entry["inc"][field] = entry["inc"].get(field, 0) + value
+        entry["set"].update(set_fields)
+
+    for transaction in transactions:
+        merge(transaction["fecha"], transaction.get("caja_id"), *_sale_increments(transaction))
+    for operation in operations:
+        inc = _cash_increments(operation["tipo_operacion"], float(operation["monto"]))
+        merge(operation["fecha"], operation.get("caja_id"), inc, {})
+
+    if not updates:
+        return
+    requests = []
+    for rollup_id, entry in updates.items():
+        update = {"$inc": entry["inc"], "$setOnInsert": {"fecha": entry["day"], "caja_id": entry["caja_id"]}}
+        if entry["set"]:
+            update["$set"] = entry["set"]
+        requests.append(UpdateOne({"_id": rollup_id}, update, upsert=True))
+    await db.daily_rollups.bulk_write(requests, ordered=False, session=session)
+
+
+async def find_rollups(
+    caja_id: Optional[int],
+    desde: str,
+    hasta: Optional[str] = None,
+    database: AsyncIOMotorDatabase = db,
+) -> list[dict]:
+    """Rollups con fecha en [desde, hasta]; sin caja_id devuelve los de todas las cajas.
+
+    Con database=read_db la lectura puede ir a un secundario.
+    """
+    fecha_filter = {"$gte": desde}
+    if hasta:
+        fecha_filter["$lte"] = hasta
+    mongo_filter = {"fecha": fecha_filter}
+    if caja_id is not None:
+        mongo_filter["caja_id"] = caja_id
+    return await database.daily_rollups.find(mongo_filter).sort([("fecha", ASCENDING), ("caja_id", ASCENDING)]).to_list(length=None)
+
+
+def sum_fields(rollups: list[dict], fields: tuple) -> dict:
+    return {field: sum(rollup.get(field, 0) for rollup in rollups) for field in fields}
+
+
+def product_units(rollups: list[dict]) -> list[dict]:
+    """Unidades vendidas por producto, de mayor a menor."""
+    units: dict[str, dict] = {}
+    for rollup in rollups:
+        for key, producto in rollup.get("productos", {}).items():
+            entry = units.setdefault(key, {"nombre": producto["nombre"], "unidades": 0})
+            entry["unidades"] += producto.get("unidades", 0)
+    return sorted(units.values(), key=lambda entry: entry["unidades"], reverse=True)
+
+
+async def rebuild_rollups(desde: Optional[datetime] = None) -> int:
+    """Reconstruye daily_rollups desde transactions y cash_operations."""
+    if desde:
+        desde = datetime(desde.year, desde.month, desde.day)
+    match = {"fecha": {"$gte": desde}} if desde else {}
+    day_expr = {"$dateToString": {"format": "%Y-%m-%d", "date": "$fecha"}}
+    rollups: dict[str, dict] = {}
+
+    def rollup_for(group_id: dict) -> dict:
+        day, caja_id = group_id["fecha"], group_id.get("caja_id")
+        return rollups.setdefault(_rollup_id(day, caja_id), _empty_rollup(day, caja_id))
+
+    sales = db.transactions.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"fecha": day_expr, "caja_id": "$caja_id"},
+            "total_transacciones": {"$sum": 1},
+            "total_ventas": {"$sum": "$total"},
+            "total_efectivo": {"$sum": "$pago"},
+            "total_credito": {"$sum": {
+                "$cond": [{"$eq": ["$pagado", "NO"]}, {"$subtract": ["$total", "$pago"]}, 0]
+            }},
+        }},
+    ])
+    async for row in sales:
+        rollup_for(row["_id"]).update({field: row[field] for field in SALES_FIELDS})
+
+    units = db.transactions.aggregate([
+        {"$match": match},
+        {"$unwind": "$productos"},
+        {"$group": {
+            "_id": {"fecha": day_expr, "caja_id": "$caja_id", "nombre": "$productos.nombre"},
+            "unidades": {"$sum": "$productos.cantidad"},
+        }},
+    ])
+    async for row in units:
+        nombre = row["_id"]["nombre"]
+        rollup_for(row["_id"])["productos"][_product_key(nombre)] = {"nombre": nombre, "unidades": row["unidades"]}
+
+    cash = db.cash_operations.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"fecha": day_expr, "caja_id": "$caja_id"},
+            "ingresos": {"$sum": {
+                "$cond": [{"$in": ["$tipo_operacion", ["INGRESO", "VENTA"]]}, {"$abs": "$monto"}, 0]
+            }},
+            "egresos": {"$sum": {
+                "$cond": [{"$eq": ["$tipo_operacion", "EGRESO"]}, {"$abs": "$monto"}, 0]
+            }},
+            "ajustes": {"$sum": {
+                "$cond": [{"$eq": ["$tipo_operacion", "AJUSTE"]}, "$monto", 0]
+            }},
+        }},
+    ])
+    async for row in cash:
+        rollup_for(row["_id"]).update({field: row[field] for field in CASH_FIELDS})
+
+    delete_filter = {"fecha": {"$gte": rollup_day(desde)}} if desde else {}
+    await db.daily_rollups.delete_many(delete_filter)
+    if rollups:
+        await db.daily_rollups.bulk_write(
+            [ReplaceOne({"_id": key}, doc, upsert=True) for key, doc in rollups.items()],
+            ordered=False,
+        )
+    return len(rollups)
@@ -0,0 +1,45 @@
+import re
+import unicodedata
+
+from pymongo import UpdateOne
+
+from database import db
+
+# Campo normalizado que acompana a cada campo de nombre buscable
+NORMALIZED_FIELDS = {
+    "transactions": ("cliente", "cliente_norm"),
+    "debtors": ("nombre", "nombre_norm"),
+}
+
+
+def normalize_name(value: str) -> str:
+    """Minusculas, sin acentos y con espacios simples: "  José  Pérez" -> "jose perez"."""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(without_accents.casefold().split())
+
+
+def prefix_filter(value: str) -> dict:
+    """Busqueda por prefijo sobre el campo normalizado; anclada para poder usar el indice."""
+    return {"$regex": "^" + re.escape(normalize_name(value))}
+
+
+async def backfill_normalized_fields(collection_name: str, batch_size: int = 1000) -> int:
+    """Completa el campo normalizado en documentos escritos antes de que existiera."""
+    source, target = NORMALIZED_FIELDS[collection_name]
+    collection = db[collection_name]
+    updated = 0
+    batch = []
+
+    cursor = collection.find({target: {"$exists": False}}, {"_id": 1, source: 1}).batch_size(batch_size)
+    async for doc in cursor:
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": {target: normalize_name(doc.get(source, ""))}}))
+        if len(batch) >= batch_size:
+            await collection.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+
+    if batch:
+        await collection.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
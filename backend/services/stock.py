@@ -0,0 +1,88 @@
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClientSession
+from pymongo import UpdateOne
+
+from database import db
+
+
+class InsufficientStock(Exception):
+    def __init__(self, faltantes: list[dict]):
+        super().__init__("Stock insuficiente")
+        self.faltantes = faltantes
+
+
+def _quantities(productos: list[dict]) -> dict[int, dict]:
+    """Cantidad total por producto_id; las lineas sin id no mueven stock."""
+    quantities: dict[int, dict] = {}
+    for producto in productos:
+        producto_id = producto.get("producto_id")
+        if producto_id is None or producto["cantidad"] <= 0:
+            continue
+        entry = quantities.setdefault(producto_id, {"nombre": producto["nombre"], "cantidad": 0})
+        entry["cantidad"] += producto["cantidad"]
+    return quantities
+
+
+async def _shortages(
+    quantities: dict[int, dict],
+    session: Optional[AsyncIOMotorClientSession],
+) -> list[dict]:
+    stock = {}
+    cursor = db.products.find({"id": {"$in": list(quantities)}}, {"_id": 0, "id": 1, "stock": 1}, session=session)
+    async for doc in cursor:
+        stock[doc["id"]] = doc.get("stock", 0)
+
+    return [
+        {
+            "producto_id": producto_id,
+            "nombre": entry["nombre"],
+            "solicitado": entry["cantidad"],
+            "disponible": stock.get(producto_id),  # None: el producto no existe
+        }
+        for producto_id, entry in quantities.items()
+        if stock.get(producto_id) is None or stock[producto_id] < entry["cantidad"]
+    ]
+
+
+async def decrement_stock(
+    productos: list[dict],
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> list[int]:
+    """Descuenta el stock vendido con $inc condicionados a stock >= cantidad.
+
+    Con sesion (transaccion) es un solo bulk_write y, si alguna linea no alcanza,
+    InsufficientStock aborta toda la venta. Sin transacciones (servidor standalone)
+    descuenta linea a linea y devuelve lo ya descontado antes de fallar.
+    Devuelve los ids de los productos cuyo stock se modifico.
+    """
+    quantities = _quantities(productos)
+    if not quantities:
+        return []
+
+    if session is not None:
+        result = await db.products.bulk_write(
+            [
+                UpdateOne({"id": producto_id, "stock": {"$gte": entry["cantidad"]}}, {"$inc": {"stock": -entry["cantidad"]}})
+                for producto_id, entry in quantities.items()
+            ],
+            ordered=False,
+            session=session,
+        )
+        if result.matched_count < len(quantities):
+            # Fuera de la sesion: dentro se verian ya descontadas las lineas que si alcanzaron
+            raise InsufficientStock(await _shortages(quantities, None))
+        return list(quantities)
+
+    applied = []
+    for producto_id, entry in quantities.items():
+        result = await db.products.update_one(
+            {"id": producto_id, "stock": {"$gte": entry["cantidad"]}},
+            {"$inc": {"stock": -entry["cantidad"]}},
+        )
+        if not result.matched_count:
+            for applied_id, cantidad in applied:
+                await db.products.update_one({"id": applied_id}, {"$inc": {"stock": cantidad}})
+            raise InsufficientStock(await _shortages(quantities, None))
+        applied.append((producto_id, entry["cantidad"]))
+    return list(quantities)
@@ -1,7 +1,37 @@
 import os
+import threading
 from pathlib import Path
+from typing import BinaryIO
 from urllib.parse import urlparse
 
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "20"))
+S3_MAX_RETRIES = int(os.getenv("S3_MAX_RETRIES", "4"))
+# Archivos mayores a este tamano se suben en partes en paralelo
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8"))
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class SizeLimitedReader:
+    """Envuelve un archivo y falla en cuanto se leen mas de max_bytes."""
+
+    def __init__(self, fileobj: BinaryIO, max_bytes: int):
+        self._fileobj = fileobj
+        self._max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._fileobj.read(size)
+        self.bytes_read += len(chunk)
+        if self.bytes_read > self._max_bytes:
+            raise UploadTooLarge(f"El archivo supera el maximo de {self._max_bytes} bytes")
+        return chunk
+
 
 def _s3_enabled() -> bool:
     return bool(
@@ -11,9 +41,10 @@ def _s3_enabled() -> bool:
     )
 
 
-def _get_s3_client():
+def _build_s3_client():
     try:
         import boto3
+        from botocore.config import Config
     except ImportError as exc:
         raise RuntimeError(
             "boto3 no esta instalado. Instala dependencias del backend para usar S3."
@@ -26,9 +57,31 @@ def _get_s3_client():
         "s3",
         region_name=region,
         endpoint_url=endpoint_url if endpoint_url else None,
+        config=Config(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            retries={"max_attempts": S3_MAX_RETRIES, "mode": "standard"},
+            tcp_keepalive=True,
+        ),
     )
 
 
+def _get_s3_client():
+    """Cliente S3 compartido por el proceso; los clientes de boto3 son thread-safe."""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = _build_s3_client()
+    return _s3_client
+
+
+def _transfer_config():
+    from boto3.s3.transfer import TransferConfig
+
+    threshold = S3_MULTIPART_THRESHOLD_MB * 1024 * 1024
+    return TransferConfig(multipart_threshold=threshold, multipart_chunksize=threshold)
+
+
 def _build_s3_public_url(object_key: str) -> str:
     custom_public_url = os.getenv("AWS_S3_PUBLIC_URL", "").rstrip("/")
     if custom_public_url:
@@ -64,6 +117,34 @@ def save_product_image(unique_name: str, file_bytes: bytes, content_type: str) -
     return f"/static/products/{unique_name}"
 
 
+def save_product_image_stream(unique_name: str, fileobj: BinaryIO, content_type: str) -> str:
+    """Como save_product_image pero leyendo de un archivo; en S3 usa multipart si es grande."""
+    if _s3_enabled():
+        bucket = os.getenv("AWS_S3_BUCKET")
+        object_key = f"products/{unique_name}"
+        s3_client = _get_s3_client()
+        s3_client.upload_fileobj(
+            fileobj,
+            bucket,
+            object_key,
+            ExtraArgs={"ContentType": content_type},
+            Config=_transfer_config(),
+        )
+        return _build_s3_public_url(object_key)
+
+    uploads_dir = Path(__file__).resolve().parents[1] / "uploads" / "products"
+    uploads_dir.mkdir(parents=True, exist_ok=True)
+    target_file = uploads_dir / unique_name
+    try:
+        with target_file.open("wb") as target:
+            while chunk := fileobj.read(1024 * 1024):
+                target.write(chunk)
+    except BaseException:
+        target_file.unlink(missing_ok=True)
+        raise
+    return f"/static/products/{unique_name}"
+
+
 def delete_product_image(image_url: str) -> None:
     if not image_url:
         return
@@ -130,10 +211,19 @@ def _get_s3_bucket_and_key(image_url: str) -> tuple[str, str]:
     raise FileNotFoundError("No se pudo determinar bucket/key desde image_url")
 
 
-def load_s3_product_image(image_url: str) -> tuple[bytes, str]:
+def open_s3_product_image(image_url: str):
+    """Devuelve (StreamingBody, content_type) sin leer el objeto completo."""
     bucket, object_key = _get_s3_bucket_and_key(image_url)
 
     s3_client = _get_s3_client()
     response = s3_client.get_object(Bucket=bucket, Key=object_key)
     content_type = response.get("ContentType") or "application/octet-stream"
-    return response["Body"].read(), content_type
+    return response["Body"], content_type
+
+
+def load_s3_product_image(image_url: str) -> tuple[bytes, str]:
+    body, content_type = open_s3_product_image(image_url)
+    try:
+        return body.read(), content_type
+    finally:
+        body.close()
@@ -0,0 +1,238 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClientSession
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import db, reserve_sequence, run_in_transaction
+from models.schemas import TransactionBatchItem
+from services.cash_ledger import apply_cash_delta
+from services.catalog_cache import catalog_cache
+from services.debts import debtor_filter
+from services.search import normalize_name
+from services.rollups import record_batch
+
+MAX_BATCH_TRANSACTIONS = 5000
+_DUPLICATE_KEY = 11000
+
+
+def _naive_utc(fecha: Optional[datetime], default: datetime) -> datetime:
+    if fecha is None:
+        return default
+    if fecha.tzinfo is not None:
+        return fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    return fecha
+
+
+async def _debt_updates(sales: list[dict]) -> list[UpdateOne]:
+    """Un upsert con $inc por deudor, sumando todas sus ventas a credito del lote.
+
+    Como add_debt, cada upsert lleva un ID reservado en $setOnInsert: si el deudor
+    ya existia el ID queda sin usar, pero un deudor creado aqui nunca queda sin id.
+    """
+    debts: dict[tuple, dict] = {}
+    for sale in sales:
+        if sale["pagado"] != "NO":
+            continue
+        key = (sale["cliente"], sale["grupo"], sale.get("caja_id"))
+        entry = debts.setdefault(key, {"deuda": 0.0, "primera": sale["fecha"], "ultima": sale["fecha"]})
+        entry["deuda"] += sale["total"] - sale["pago"]
+        entry["primera"] = min(entry["primera"], sale["fecha"])
+        entry["ultima"] = max(entry["ultima"], sale["fecha"])
+    if not debts:
+        return []
+
+    new_ids = iter(await reserve_sequence("debtors", len(debts)))
+
+    updates = []
+    for key, entry in debts.items():
+        nombre, grupo, caja_id = key
+        on_insert = {
+            "id": next(new_ids),
+            "fecha_primera_deuda": entry["primera"],
+            "nombre_norm": normalize_name(nombre),
+        }
+        updates.append(UpdateOne(
+            debtor_filter(nombre, grupo, caja_id),
+            {
+                "$inc": {"deuda": entry["deuda"]},
+                "$max": {"ultima_compra": entry["ultima"]},
+                "$setOnInsert": on_insert,
+            },
+            upsert=True,
+        ))
+    return updates
+
+
+def _sold_quantities(sales: list[dict]) -> dict[int, int]:
+    quantities: dict[int, int] = {}
+    for sale in sales:
+        for producto in sale["productos"]:
+            if producto.get("producto_id") is not None and producto["cantidad"] > 0:
+                quantities[producto["producto_id"]] = quantities.get(producto["producto_id"], 0) + producto["cantidad"]
+    return quantities
+
+
+def _stock_updates(quantities: dict[int, int]) -> list[UpdateOne]:
+    """Descuento de stock de ventas ya realizadas: no se rechazan, el stock queda en 0 como minimo."""
+    return [
+        UpdateOne(
+            {"id": producto_id},
+            [{"$set": {"stock": {"$max": [0, {"$subtract": [{"$ifNull": ["$stock", 0]}, cantidad]}]}}}],
+        )
+        for producto_id, cantidad in quantities.items()
+    ]
+
+
+async def _record_cash(operations: list[dict], session: Optional[AsyncIOMotorClientSession]) -> None:
+    """Un $inc por caja y el saldo de cada operacion derivado del saldo final."""
+    by_caja: dict[Optional[int], list[dict]] = {}
+    for operation in operations:
+        by_caja.setdefault(operation.get("caja_id"), []).append(operation)
+
+    for caja_id, caja_operations in by_caja.items():
+        delta = sum(operation["monto"] for operation in caja_operations)
+        ultima = max(operation["fecha"] for operation in caja_operations)
+        saldo = await apply_cash_delta(caja_id, delta, ultima, session=session) - delta
+        for operation in caja_operations:
+            saldo += operation["monto"]
+            operation["saldo"] = saldo
+
+    await db.cash_operations.insert_many([dict(operation) for operation in operations], session=session)
+
+
+async def _insert_sales(sales: list[dict], session: Optional[AsyncIOMotorClientSession]) -> list[dict]:
+    """Inserta las ventas y devuelve las que quedaron guardadas.
+
+    Con transaccion un duplicado aborta todo y ingest_batch recalcula el lote. Sin
+    transaccion (standalone) no hay vuelta atras: las claves que otro reintento guardo
+    mientras tanto se omiten y solo las ventas insertadas siguen con sus efectos.
+    """
+    documents = [dict(sale) for sale in sales]
+    if session is not None:
+        await db.transactions.insert_many(documents, session=session)
+        return sales
+
+    try:
+        await db.transactions.insert_many(documents, ordered=False)
+        return sales
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != _DUPLICATE_KEY for error in errors):
+            raise
+        failed = {error["index"] for error in errors}
+        return [sale for index, sale in enumerate(sales) if index not in failed]
+
+
+async def _ingest(items: list[TransactionBatchItem]) -> list[dict]:
+    results: list[dict] = []
+    first_index: dict[str, int] = {}
+    for index, item in enumerate(items):
+        results.append({"idempotency_key": item.idempotency_key})
+        first_index.setdefault(item.idempotency_key, index)
+
+    existing = {}
+    cursor = db.transactions.find(
+        {"idempotency_key": {"$in": list(first_index)}},
+        {"_id": 0, "idempotency_key": 1, "id": 1},
+    )
+    async for doc in cursor:
+        existing[doc["idempotency_key"]] = doc["id"]
+
+    pending = sorted(index for key, index in first_index.items() if key not in existing)
+
+    # IDs de todo el lote en dos round trips a "counters"
+    transaction_ids = iter(await reserve_sequence("transactions", len(pending))) if pending else iter(())
+    paid = [index for index in pending if items[index].pago > 0]
+    cash_ids = iter(await reserve_sequence("cash_operations", len(paid))) if paid else iter(())
+
+    now = datetime.utcnow()
+    sales = []
+    operations = {}  # id de venta -> operacion de caja
+    for index in pending:
+        item = items[index]
+        sale = item.model_dump(exclude={"fecha"})
+        sale["id"] = next(transaction_ids)
+        sale["fecha"] = _naive_utc(item.fecha, now)
+        sale["cliente_norm"] = normalize_name(item.cliente)
+        sales.append(sale)
+        results[index].update(status="creada", id=sale["id"])
+
+        if item.pago > 0:
+            # Igual que una venta individual: la caja registra el total de la venta.
+            # La fecha es la de ingreso al libro, no la de la terminal: su saldo es el de
+            # la caja al ingresar el lote y el rollup de caja la cuenta ese dia.
+            operations[sale["id"]] = {
+                "tipo_operacion": "VENTA",
+                "monto": item.total,
+                "descripcion": f"Venta a {item.cliente} - {len(item.productos)} productos",
+                "caja_id": item.caja_id,
+                "id": next(cash_ids),
+                "fecha": now,
+            }
+
+    for index, item in enumerate(items):
+        if "status" not in results[index]:
+            key = item.idempotency_key
+            original = existing.get(key, results[first_index[key]].get("id"))
+            results[index].update(status="duplicada", id=original)
+
+    if not sales:
+        return results
+
+    inserted: list[dict] = []
+
+    async def commit_batch(session):
+        nonlocal inserted
+        inserted = await _insert_sales(sales, session)
+        sale_operations = [operations[sale["id"]] for sale in inserted if sale["id"] in operations]
+        debt_updates = await _debt_updates(inserted)
+        if debt_updates:
+            await db.debtors.bulk_write(debt_updates, ordered=False, session=session)
+        stock_updates = _stock_updates(_sold_quantities(inserted))
+        if stock_updates:
+            await db.products.bulk_write(stock_updates, ordered=False, session=session)
+        if sale_operations:
+            await _record_cash(sale_operations, session)
+        await record_batch(inserted, sale_operations, session=session)
+
+    await run_in_transaction(commit_batch)
+    sold_products = _sold_quantities(inserted)
+    if sold_products:
+        catalog_cache.invalidate_products(sold_products)
+
+    # Ventas que otro reintento guardo primero (solo sin transacciones)
+    inserted_ids = {sale["id"] for sale in inserted}
+    raced = {sale["idempotency_key"] for sale in sales if sale["id"] not in inserted_ids}
+    if raced:
+        original_ids = {}
+        async for doc in db.transactions.find({"idempotency_key": {"$in": list(raced)}}, {"_id": 0, "idempotency_key": 1, "id": 1}):
+            original_ids[doc["idempotency_key"]] = doc["id"]
+        for index, item in enumerate(items):
+            if item.idempotency_key in raced:
+                results[index].update(status="duplicada", id=original_ids.get(item.idempotency_key))
+    return results
+
+
+async def ingest_batch(items: list[TransactionBatchItem]) -> dict:
+    """Registra un lote ordenado de ventas offline; las claves ya vistas se omiten.
+
+    Si otra peticion inserta la misma clave mientras tanto (reintento en paralelo),
+    el indice unico de idempotency_key aborta la transaccion y el lote se vuelve a
+    calcular; sin transacciones esas ventas se marcan como duplicadas (_insert_sales).
+    """
+    try:
+        results = await _ingest(items)
+    except BulkWriteError as e:
+        if any(error.get("code") != _DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+            raise
+        results = await _ingest(items)
+
+    creadas = sum(1 for result in results if result["status"] == "creada")
+    return {
+        "total": len(results),
+        "creadas": creadas,
+        "duplicadas": len(results) - creadas,
+        "resultados": results,
+    }
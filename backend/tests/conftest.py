@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+# Las pruebas nunca usan la base del .env: las que necesitan MongoDB leen MONGODB_TEST_URI
+# (replica set) y escriben en MONGODB_TEST_DB; el resto no llega a conectarse
+os.environ["MONGODB_URI"] = os.getenv("MONGODB_TEST_URI", "mongodb://localhost:27017")
+os.environ["MONGODB_DB"] = os.getenv("MONGODB_TEST_DB", "la_tiendita_test")
+
+# Agregar el directorio backend al path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
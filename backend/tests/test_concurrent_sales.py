@@ -0,0 +1,75 @@
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+import pytest
+from pymongo import MongoClient
+
+import database
+from database import db, get_next_sequence, init_database
+from main import app
+from services.cash_ledger import _ledger_balance
+
+TOTAL_SALES = int(os.getenv("MONGODB_TEST_SALES", "200"))
+MONTO = 1.25
+
+
+def _replica_set_error() -> Optional[str]:
+    """Motivo para omitir la prueba si no hay un replica set en MONGODB_TEST_URI."""
+    if not os.getenv("MONGODB_TEST_URI"):
+        return "MONGODB_TEST_URI no definido"
+    options = {**database._client_options, "serverSelectionTimeoutMS": 3000, "event_listeners": []}
+    try:
+        with MongoClient(database.mongodb_uri, **options) as client:
+            hello = client.admin.command("hello")
+    except Exception as e:
+        return f"MongoDB no disponible: {e}"
+    if "setName" not in hello:
+        return "MONGODB_TEST_URI no es un replica set (sin transacciones)"
+    return None
+
+
+SKIP_REASON = _replica_set_error()
+
+
+async def _fire_sales(caja_id: int) -> tuple[list[int], float]:
+    sale = {
+        "cliente": "Prueba concurrencia",
+        "grupo": "General",
+        "productos": [{"nombre": "Prueba", "cantidad": 1, "precio_unitario": MONTO, "subtotal": MONTO}],
+        "total": MONTO,
+        "pago": MONTO,
+        "cambio": 0,
+        "pagado": "SI",
+        "caja_id": caja_id,
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        responses = await asyncio.gather(*(client.post("/api/transactions/", json=sale) for _ in range(TOTAL_SALES)))
+        balance = await client.get("/api/cash/balance", params={"caja_id": caja_id})
+    return [response.status_code for response in responses], balance.json()["saldo"]
+
+
+async def _run() -> None:
+    await init_database()
+    caja_id = await get_next_sequence("cajas")
+    await db.cajas.insert_one({"id": caja_id, "nombre": f"Prueba {caja_id}", "saldo_inicial": 10.0, "activa": True})
+    try:
+        statuses, saldo = await _fire_sales(caja_id)
+
+        assert statuses == [201] * TOTAL_SALES
+        assert saldo == pytest.approx(10.0 + TOTAL_SALES * MONTO)
+        # El saldo materializado y la suma del libro deben coincidir
+        assert (await _ledger_balance(caja_id))[0] == pytest.approx(saldo)
+        assert await db.cash_operations.count_documents({"caja_id": caja_id}) == TOTAL_SALES
+    finally:
+        for collection in (db.transactions, db.cash_operations, db.daily_rollups):
+            await collection.delete_many({"caja_id": caja_id})
+        await db.caja_balances.delete_one({"_id": caja_id})
+        await db.cajas.delete_one({"id": caja_id})
+
+
+@pytest.mark.skipif(SKIP_REASON is not None, reason=SKIP_REASON or "")
+def test_concurrent_sales_keep_caja_balance():
+    asyncio.run(_run())
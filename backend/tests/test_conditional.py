@@ -0,0 +1,23 @@
+import pytest
+from starlette.requests import Request
+
+from services.conditional import etag_matches
+
+ETAG = '"abc123"'
+
+
+def _request(if_none_match=None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ('"abc123"', True),
+    ('W/"abc123"', True),
+    ('"otro", "abc123"', True),
+    ("*", True),
+    ('"otro"', False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(_request(header), ETAG) is expected
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+from services.metrics import CommandMetricsListener, Histogram, MetricsRegistry, _request_db
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latencia_seconds", "Latencia.", ("route",), (0.1, 1.0))
+    for value in (0.05, 0.5, 2.0):
+        histogram.observe(("/api",), value)
+
+    assert histogram.render() == [
+        "# HELP latencia_seconds Latencia.",
+        "# TYPE latencia_seconds histogram",
+        'latencia_seconds_bucket{route="/api",le="0.1"} 1',
+        'latencia_seconds_bucket{route="/api",le="1"} 2',
+        'latencia_seconds_bucket{route="/api",le="+Inf"} 3',
+        'latencia_seconds_sum{route="/api"} 2.55',
+        'latencia_seconds_count{route="/api"} 3',
+    ]
+
+
+def test_labels_are_escaped():
+    histogram = Histogram("x", "X.", ("route",), (1.0,))
+    histogram.observe(('/a"b\\c',), 0.5)
+    assert 'x_count{route="/a\\"b\\\\c"} 1' in histogram.render()
+
+
+def test_command_listener_counts_per_collection_and_request():
+    registry = MetricsRegistry()
+    listener = CommandMetricsListener(registry)
+    request_db = {"commands": 0, "duration": 0.0, "collections": {}}
+    token = _request_db.set(request_db)
+    try:
+        listener.started(SimpleNamespace(command={"find": "products"}, command_name="find", connection_id=1, request_id=1))
+        listener.succeeded(SimpleNamespace(command_name="find", connection_id=1, request_id=1, duration_micros=2000))
+        listener.started(SimpleNamespace(command={"getMore": 9, "collection": "transactions"}, command_name="getMore", connection_id=1, request_id=2))
+        listener.failed(SimpleNamespace(command_name="getMore", connection_id=1, request_id=2, duration_micros=1000))
+    finally:
+        _request_db.reset(token)
+
+    assert request_db == {
+        "commands": 2,
+        "duration": 0.003,
+        "collections": {"products": [1, 0.002], "transactions": [1, 0.001]},
+    }
+    text = registry.render()
+    assert 'mongodb_command_duration_seconds_count{collection="products",command="find"} 1' in text
+    assert 'mongodb_command_failures_total{collection="transactions",command="getMore"} 1' in text
+
+
+def test_request_metrics_per_collection():
+    registry = MetricsRegistry()
+    db_stats = {"commands": 3, "duration": 0.004, "collections": {"products": [2, 0.003], "counters": [1, 0.001]}}
+    registry.observe_request("POST", "/api/transactions/", 201, 0.02, db_stats)
+
+    text = registry.render()
+    assert 'http_request_db_commands_count{method="POST",route="/api/transactions/"} 1' in text
+    assert 'http_request_db_collection_commands_sum{method="POST",route="/api/transactions/",collection="products"} 2' in text
+    assert 'http_request_db_collection_duration_seconds_sum{method="POST",route="/api/transactions/",collection="counters"} 0.001' in text
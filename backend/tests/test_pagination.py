@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pytest
+from pymongo import ASCENDING, DESCENDING
+
+from services.pagination import decode_cursor, encode_cursor, keyset_filter
+
+BY_FECHA = [("fecha", DESCENDING), ("id", DESCENDING)]
+
+
+def test_cursor_round_trip_keeps_datetimes():
+    doc = {"fecha": datetime(2025, 1, 2, 3, 4, 5), "id": 7, "total": 10}
+    assert decode_cursor(encode_cursor(doc, BY_FECHA), BY_FECHA) == [doc["fecha"], 7]
+
+
+def test_keyset_filter_descending():
+    fecha = datetime(2025, 1, 2)
+    token = encode_cursor({"fecha": fecha, "id": 7}, BY_FECHA)
+    assert keyset_filter({}, BY_FECHA, token) == {
+        "$or": [{"fecha": {"$lt": fecha}}, {"fecha": fecha, "id": {"$lt": 7}}]
+    }
+
+
+def test_keyset_filter_mixed_directions_keeps_existing_filter():
+    sort = [("cliente_norm", ASCENDING), ("fecha", DESCENDING), ("id", DESCENDING)]
+    fecha = datetime(2025, 1, 2)
+    token = encode_cursor({"cliente_norm": "jose", "fecha": fecha, "id": 3}, sort)
+    base = {"cliente_norm": {"$regex": "^jo"}}
+    assert keyset_filter(base, sort, token) == {
+        "$and": [
+            base,
+            {"$or": [
+                {"cliente_norm": {"$gt": "jose"}},
+                {"cliente_norm": "jose", "fecha": {"$lt": fecha}},
+                {"cliente_norm": "jose", "fecha": fecha, "id": {"$lt": 3}},
+            ]},
+        ]
+    }
+
+
+@pytest.mark.parametrize("token", ["no-es-base64!", encode_cursor({"id": 1}, [("id", DESCENDING)])])
+def test_invalid_or_mismatched_cursor(token):
+    with pytest.raises(ValueError):
+        keyset_filter({}, BY_FECHA, token)
@@ -0,0 +1,27 @@
+import pytest
+
+from services.product_import import parse_rows
+
+
+def test_parse_json_list_and_wrapped_object():
+    rows = [{"name": "Pan", "price": 1.2}]
+    assert parse_rows(b'[{"name": "Pan", "price": 1.2}]', "application/json") == rows
+    assert parse_rows(b'{"products": [{"name": "Pan", "price": 1.2}]}', "application/json") == rows
+
+
+def test_parse_csv_drops_empty_cells_and_bom():
+    body = "﻿name,price,stock,image_url\nPan,1.2,,\nLeche,1.8,4,\n".encode("utf-8")
+    assert parse_rows(body, "text/csv") == [
+        {"name": "Pan", "price": "1.2"},
+        {"name": "Leche", "price": "1.8", "stock": "4"},
+    ]
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"name,precio\nPan,1\n", "text/csv"),
+    (b'{"items": []}', "application/json"),
+    (b'[1, 2]', "application/json"),
+])
+def test_parse_rejects_invalid_payloads(body, content_type):
+    with pytest.raises(ValueError):
+        parse_rows(body, content_type)
@@ -0,0 +1,24 @@
+import re
+
+import pytest
+
+from services.search import normalize_name, prefix_filter
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("José Pérez", "jose perez"),
+    ("  MARÍA   de  los Ángeles ", "maria de los angeles"),
+    ("Ñandú", "nandu"),
+    ("Straße", "strasse"),
+    ("", ""),
+    (None, ""),
+])
+def test_normalize_name(value, expected):
+    assert normalize_name(value) == expected
+
+
+def test_prefix_filter_is_anchored_and_escaped():
+    pattern = prefix_filter("Jo.sé (")["$regex"]
+    assert pattern == "^" + re.escape("jo.se (")
+    assert re.match(pattern, "jo.se (x)")
+    assert not re.match(pattern, "joXse (x)")